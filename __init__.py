@@ -44,10 +44,48 @@ class Witcher3AddonPrefs(bpy.types.AddonPreferences):
 		description="Path to where you uncooked the game using wcc_lite.exe or another tool. Will be searching for .tga textures here."
 	)
 
+	use_texture_index: BoolProperty(
+		name="Use Texture Index",
+		default=False,
+		description="Scan the Uncooked folder once and look up textures in an index stored on disk, instead of checking every texture file on the disk. Recommended when the Uncooked folder is on a network drive"
+	)
+
+	use_import_cache: BoolProperty(
+		name="Use Import Cache",
+		default=False,
+		description="Save the result of importing each FBX, and re-use it when the same FBX is imported again with the same settings"
+	)
+
+	import_cache_size: IntProperty(
+		name="Import Cache Size (MB)",
+		default=2048,
+		min=0,
+		description="When the import cache gets bigger than this, the least recently used imports are deleted from it"
+	)
+
+	link_node_groups: BoolProperty(
+		name="Link Node Groups",
+		default=False,
+		description="Link the Witcher 3 node groups from the add-on's .blend file instead of appending them, so all scenes share one copy. The scenes will then depend on the add-on being installed"
+	)
+
+	use_material_templates: BoolProperty(
+		name="Material Templates",
+		default=True,
+		description="Make materials by copying an already imported material with the same nodes and only changing the values and images, instead of creating all the nodes again"
+	)
+
 	def draw(self, context):
 		layout = self.layout
 		layout.label(text="Witcher 3 FBX Importer settings:")
 		layout.prop(self, "uncook_path")
+		layout.prop(self, "use_texture_index")
+		layout.prop(self, "link_node_groups")
+		layout.prop(self, "use_material_templates")
+		layout.prop(self, "use_import_cache")
+		row = layout.row()
+		row.enabled = self.use_import_cache
+		row.prop(self, "import_cache_size")
 
 def register():
 	import_witcher3_fbx.register()
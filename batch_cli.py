@@ -0,0 +1,193 @@
+# Blender Witcher 3 Importer Add-on
+# Copyright (C) 2019 Mets3D
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Command line entry point, for converting character folders to .blend files without the UI. One .blend file is saved per character folder.
+# Everything after "--" is passed to this script:
+#
+#	blender -b --python-expr "import batch_import_witcher3_fbx.batch_cli as cli; cli.main()" -- --uncook E:\Uncooked --output E:\Blends --workers 4 E:\Export\characters\models\main_npc\ciri E:\Export\characters\models\main_npc\yennefer
+#
+# With --workers N, each character is converted by its own background Blender process, N at a time.
+
+import bpy
+import addon_utils
+import argparse
+import os
+import sys
+import subprocess
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from . import import_witcher3_fbx
+from . import import_profiler
+from . import import_cache
+from . import import_planner
+
+ADDON_NAME = __package__
+
+def parse_args(argv):
+	parser = argparse.ArgumentParser(
+		prog="batch_cli",
+		description="Import Witcher 3 character folders exported by wcc_lite.exe and save each of them as a .blend file."
+	)
+	parser.add_argument('folders', nargs='+', help="Character folders containing the .fbx and .xml files")
+	parser.add_argument('--uncook', required=True, help="Path to the Uncooked folder, where the .tga textures are")
+	parser.add_argument('--output', default=None, help="Folder to save the .blend files in. Defaults to the parent folder of each character folder")
+	parser.add_argument('--workers', type=int, default=1, help="Number of background Blender processes to convert characters with")
+	parser.add_argument('--overwrite', action='store_true', help="Convert characters even if their .blend file already exists")
+	parser.add_argument('--no-recursive', dest='recursive', action='store_false', help="Ignore subfolders of the character folders")
+	parser.add_argument('--keep-lods', dest='keep_lod_meshes', action='store_true', help="Keep low quality meshes and materials")
+	parser.add_argument('--no-remove-doubles', dest='remove_doubles', action='store_false', help="Don't merge verts in the same location")
+	parser.add_argument('--no-quadrangulate', dest='quadrangulate', action='store_false', help="Don't convert tris to quads")
+	parser.add_argument('--separate-armatures', dest='combined_armatures', action='store_false', help="Don't merge all armatures of a character into one")
+	parser.add_argument('--texture-index', dest='use_texture_index', action='store_true', help="Look up textures in an index of the Uncooked folder")
+	parser.add_argument('--link-node-groups', dest='link_resources', action='store_true', help="Link the node groups from the add-on's .blend file instead of appending them")
+	parser.add_argument('--lazy-textures', dest='lazy_textures', action='store_true', help="Don't load textures, only remember which ones to use")
+	parser.add_argument('--no-material-templates', dest='use_templates', action='store_false', help="Build every material's nodes from scratch instead of copying a material with the same nodes")
+	parser.add_argument('--texture-resolution', choices=['FULL', 'HALF', 'QUARTER'], default='FULL', help="Use downscaled copies of the textures")
+	parser.add_argument('--cache', dest='use_cache', action='store_true', help="Re-use previously imported FBX files from the import cache")
+	parser.add_argument('--cache-size', type=int, default=2048, help="Import cache size limit in MB")
+	parser.add_argument('--report', action='store_true', help="Save an import report .json next to each .blend file")
+	parser.add_argument('--plan', action='store_true', help="Don't convert anything, only check the folders and save an import plan .json where each .blend file would go")
+	parser.add_argument('--rates-from', dest='rates_from', default=None, help="Import report .json (see --report) to measure the import time estimate of --plan from")
+	return parser.parse_args(argv)
+
+def script_argv():
+	# Blender's own arguments come before "--".
+	if('--' in sys.argv):
+		return sys.argv[sys.argv.index('--')+1:]
+	return []
+
+def option_argv(args):
+	# Command line options to forward to worker processes, everything except the folders and the worker count.
+	argv = ['--uncook', args.uncook]
+	if(args.output):				argv += ['--output', args.output]
+	if(args.overwrite):				argv.append('--overwrite')
+	if(not args.recursive):			argv.append('--no-recursive')
+	if(args.keep_lod_meshes):		argv.append('--keep-lods')
+	if(not args.remove_doubles):	argv.append('--no-remove-doubles')
+	if(not args.quadrangulate):		argv.append('--no-quadrangulate')
+	if(not args.combined_armatures):argv.append('--separate-armatures')
+	if(args.use_texture_index):		argv.append('--texture-index')
+	if(args.link_resources):		argv.append('--link-node-groups')
+	if(args.lazy_textures):			argv.append('--lazy-textures')
+	if(not args.use_templates):		argv.append('--no-material-templates')
+	if(args.texture_resolution != 'FULL'):	argv += ['--texture-resolution', args.texture_resolution]
+	if(args.use_cache):				argv += ['--cache', '--cache-size', str(args.cache_size)]
+	if(args.report):				argv.append('--report')
+	return argv
+
+def character_name(folder):
+	return os.path.basename(os.path.normpath(folder)).capitalize()
+
+def blend_path(folder, args):
+	output_dir = args.output if args.output else os.path.dirname(os.path.normpath(folder))
+	return os.path.join(output_dir, character_name(folder) + ".blend")
+
+def ensure_addon_enabled():
+	# Loading a new file can reset the preferences, so this is done after every reset.
+	addon_utils.enable(ADDON_NAME, default_set=False)
+
+def convert_character(folder, args):
+	# Import one character folder into an empty scene and save it.
+	out_path = blend_path(folder, args)
+	if(os.path.isfile(out_path) and not args.overwrite):
+		print("Skipping, already converted: " + out_path)
+		return out_path
+
+	char_name = character_name(folder)
+	print("Converting character: " + char_name + " (" + folder + ")")
+	bpy.ops.wm.read_homefile(use_empty=True)
+	ensure_addon_enabled()
+
+	import_witcher3_fbx.batch_import_w3_fbx(folder, args.uncook, char_name,
+		recursive=args.recursive,
+		keep_lod_meshes=args.keep_lod_meshes,
+		remove_doubles=args.remove_doubles,
+		quadrangulate=args.quadrangulate,
+		combined_armatures=args.combined_armatures,
+		use_texture_index=args.use_texture_index,
+		use_cache=args.use_cache,
+		link_resources=args.link_resources,
+		lazy_textures=args.lazy_textures,
+		texture_resolution=args.texture_resolution,
+		use_templates=args.use_templates)
+
+	os.makedirs(os.path.dirname(out_path), exist_ok=True)
+	bpy.ops.wm.save_as_mainfile(filepath=out_path)
+
+	profiler = import_profiler.profiler
+	profiler.print_summary()
+	import_witcher3_fbx.image_pool.print_report()
+	if(args.report):
+		profiler.save_report(os.path.splitext(out_path)[0] + "_import_report.json")
+	return out_path
+
+def plan_character(folder, args):
+	# Dry run of convert_character(). Returns the number of problems found.
+	texture_index = import_witcher3_fbx.get_texture_index(args.uncook) if args.use_texture_index else None
+	print("Planning character: " + character_name(folder) + " (" + folder + ")")
+	rates = import_planner.rates_from_report(args.rates_from) if args.rates_from else None
+	plan = import_planner.plan_import(folder, args.uncook, args.recursive, texture_index, rates)
+	import_planner.print_plan(plan)
+	plan_path = os.path.splitext(blend_path(folder, args))[0] + "_import_plan.json"
+	os.makedirs(os.path.dirname(plan_path), exist_ok=True)
+	import_planner.save_plan(plan, plan_path)
+	summary = plan['summary']
+	return summary['errors'] + summary['missing_textures']
+
+def worker_command(folder, args):
+	expr = "import %s.batch_cli as cli; cli.main()" % ADDON_NAME
+	return [bpy.app.binary_path, '-b', '--factory-startup', '--python-expr', expr, '--'] + option_argv(args) + [folder]
+
+def run_workers(args):
+	# Every folder is a job. A thread per worker starts a background Blender process for the next job and waits for it.
+	def run_job(folder):
+		print("Starting worker for: " + folder)
+		return subprocess.run(worker_command(folder, args)).returncode
+
+	with ThreadPoolExecutor(max_workers=args.workers) as executor:
+		return_codes = list(executor.map(run_job, args.folders))
+	return [folder for folder, code in zip(args.folders, return_codes) if code != 0]
+
+def main(argv=None):
+	if(argv == None):
+		argv = script_argv()
+	args = parse_args(argv)
+	import_cache.max_size = args.cache_size * 1024 * 1024
+
+	if(args.plan):
+		# Planning only reads files, so it's fast enough to do in this process.
+		problems = sum(plan_character(folder, args) for folder in args.folders)
+		print("Planned %d characters, %d problems found." %(len(args.folders), problems))
+		if(problems > 0):
+			sys.exit(1)
+		return
+
+	if(args.workers > 1 and len(args.folders) > 1):
+		failed = run_workers(args)
+	else:
+		failed = []
+		for folder in args.folders:
+			try:
+				convert_character(folder, args)
+			except Exception:
+				traceback.print_exc()
+				failed.append(folder)
+
+	print("Converted %d of %d characters." %(len(args.folders)-len(failed), len(args.folders)))
+	for folder in failed:
+		print("FAILED: " + folder)
+	if(len(failed) > 0):
+		sys.exit(1)
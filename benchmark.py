@@ -0,0 +1,300 @@
+# Blender Witcher 3 Importer Add-on
+# Copyright (C) 2019 Mets3D
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Benchmark of the import pipeline on a synthetic character folder, for catching performance regressions.
+# The folder is generated like wcc_lite.exe would export it: one .fbx and .xml per piece, with Witcher 3 bone names, and .tga textures in a fake Uncooked folder.
+# Each run imports the folder into an empty scene with batch_import_w3_fbx() and records the time of every stage from import_profiler.
+# Everything after "--" is passed to this script:
+#
+#	blender -b --factory-startup --python-expr "import batch_import_witcher3_fbx.benchmark as b; b.main()" -- --output E:\Benchmark --pieces 20 --materials 4 --runs 3 --compare E:\Benchmark\benchmark_old.json
+#
+# The folder is only generated again when the generator settings change.
+
+import bpy
+import bmesh
+import argparse
+import os
+import sys
+import shutil
+import json
+import time
+import statistics
+from xml.sax.saxutils import quoteattr
+import numpy as np
+from . import import_witcher3_fbx
+from . import import_profiler
+from . import batch_cli
+from . import tga_preview
+
+GENERATOR_VERSION = 1	# Increase this when the generated files change, so old benchmark folders get generated again.
+
+# Shaders of the generated materials, one of each family, in turns.
+SHADERS = ['pbr_std', 'pbr_skin', 'pbr_hair', 'pbr_eye']
+
+# Differences smaller than this are noise, not regressions.
+MIN_REGRESSION_TIME = 0.05
+
+def parse_args(argv):
+	parser = argparse.ArgumentParser(
+		prog="benchmark",
+		description="Generate a synthetic Witcher 3 character folder and time importing it."
+	)
+	parser.add_argument('--output', required=True, help="Folder for the generated files and the results")
+	parser.add_argument('--pieces', type=int, default=10, help="Number of FBX files")
+	parser.add_argument('--materials', type=int, default=4, help="Number of materials per FBX file")
+	parser.add_argument('--grid', type=int, default=64, help="Grid resolution of each mesh, the meshes have grid*grid faces")
+	parser.add_argument('--bones', type=int, default=40, help="Number of bones of each armature")
+	parser.add_argument('--texture-size', type=int, default=256, help="Width and height of the textures")
+	parser.add_argument('--lods', action='store_true', help="Add a LOD mesh to each FBX file")
+	parser.add_argument('--runs', type=int, default=3, help="Number of times to import the folder")
+	parser.add_argument('--regenerate', action='store_true', help="Generate the folder even if it's up to date")
+	parser.add_argument('--compare', default=None, help="Results .json of an earlier benchmark. Exit with an error if a stage got slower")
+	parser.add_argument('--threshold', type=float, default=1.25, help="Times slower a stage has to be than in --compare to count as a regression")
+	return parser.parse_args(argv)
+
+def generator_config(args):
+	# Settings that affect the generated files.
+	return {
+		'version' : GENERATOR_VERSION,
+		'pieces' : args.pieces,
+		'materials' : args.materials,
+		'grid' : args.grid,
+		'bones' : args.bones,
+		'texture_size' : args.texture_size,
+		'lods' : args.lods,
+	}
+
+def bone_names(count):
+	# Bones of the Witcher 3 skeleton, parents before children, so they can be fixed by parent_w3_bones().
+	names = ['torso']
+	for child, parent in import_witcher3_fbx.W3_BONE_PARENTS.items():
+		if(parent not in names):
+			names.append(parent)
+		if(child not in names):
+			names.append(child)
+	return names[:count]
+
+def texture_value(piece, material, kind):
+	# Path of a texture relative to the Uncooked folder, as written in the XML. Normal maps are shared between pieces, like in the game.
+	if(kind == 'n'):
+		name = "synthetic_m%02d_n01.xbm" %material
+	else:
+		name = "piece%02d_m%02d_%s01.xbm" %(piece, material, kind)
+	return os.sep.join(['characters', 'models', 'synthetic', 'textures', name])
+
+def write_texture(uncook_path, value, size, seed):
+	path = os.path.join(uncook_path, value.replace(".xbm", ".tga"))
+	os.makedirs(os.path.dirname(path), exist_ok=True)
+	pixels = np.random.RandomState(seed).randint(0, 256, (size, size, 4)).astype(np.uint8)
+	tga_preview.write_tga(path, pixels, 8)	# 8 alpha bits, bottom left origin.
+
+def material_params(piece, material):
+	# (name, type, value) of the parameters of a generated material.
+	params = [
+		('Diffuse', 'handle:ITexture', texture_value(piece, material, 'd')),
+		('Normal', 'handle:ITexture', texture_value(piece, material, 'n')),
+		('SpecularColor', 'Color', "%d; %d; %d; 255" %(40 + material, 40, 40)),
+		('RSpecScale', 'Float', "0.5"),
+		('RSpecBase', 'Float', "0.1"),
+	]
+	if(SHADERS[material % len(SHADERS)] == 'pbr_std'):
+		params += [
+			('DetailNormal', 'handle:ITexture', texture_value(piece, material, 'n')),
+			('DetailTile', 'Vector', "4; 4; 0; 1"),
+			('DetailRotation', 'Float', "0.25"),
+			('DetailPower', 'Float', "0.5"),
+		]
+	return params
+
+def write_xml(xml_path, piece, material_count):
+	# Same schema as the .xml files of wcc_lite.exe, including the UTF-16 declaration of a file that isn't UTF-16.
+	lines = ['<?xml version="1.0" encoding="UTF-16"?>', '<entity>', '\t<materials>']
+	for m in range(material_count):
+		base = "engine\\materials\\graphs\\%s.w2mg" %SHADERS[m % len(SHADERS)]
+		lines.append('\t\t<material name=%s base=%s>' %(quoteattr("Material%d" %m), quoteattr(base)))
+		for name, type, value in material_params(piece, m):
+			lines.append('\t\t\t<param name=%s type=%s value=%s />' %(quoteattr(name), quoteattr(type), quoteattr(value)))
+		lines.append('\t\t</material>')
+	lines += ['\t</materials>', '</entity>', '']
+	with open(xml_path, 'w') as f:
+		f.write("\n".join(lines))
+
+def make_mesh(name, config, bones):
+	# Grid mesh with material slots, a UV map and vertex groups for the first 3/4 of the bones, so delete_unused_bones() has work to do.
+	mesh = bpy.data.meshes.new(name)
+	bm = bmesh.new()
+	bmesh.ops.create_grid(bm, x_segments=config['grid'], y_segments=config['grid'], size=1.0, calc_uvs=True)
+	for f in bm.faces:
+		f.material_index = f.index % config['materials']
+	bm.to_mesh(mesh)
+	bm.free()
+	for m in range(config['materials']):
+		mat_name = "Material%d" %m
+		mesh.materials.append(bpy.data.materials.get(mat_name) or bpy.data.materials.new(mat_name))
+
+	obj = bpy.data.objects.new(name, mesh)
+	bpy.context.scene.collection.objects.link(obj)
+	used_bones = bones[:max(1, len(bones)*3//4)]
+	groups = [obj.vertex_groups.new(name=bone) for bone in used_bones]
+	for i in range(len(mesh.vertices)):
+		groups[i % len(groups)].add([i], 1.0, 'REPLACE')
+	return obj
+
+def make_armature(name, bones):
+	# Unparented bones, like in the exported files, which parent_w3_bones() fixes.
+	arm = bpy.data.objects.new(name, bpy.data.armatures.new(name))
+	bpy.context.scene.collection.objects.link(arm)
+	bpy.context.view_layer.objects.active = arm
+	bpy.ops.object.mode_set(mode='EDIT')
+	for i, bone in enumerate(bones):
+		eb = arm.data.edit_bones.new(bone)
+		eb.head = (i*0.02, 0, 1)
+		eb.tail = (i*0.02, 0, 1.1)
+	bpy.ops.object.mode_set(mode='OBJECT')
+	return arm
+
+def generate_piece(folder, piece, config, bones):
+	name = "piece%02d" %piece
+	fbx_path = os.path.join(folder, name + ".fbx")
+
+	arm = make_armature(name + "_Armature", bones)
+	objects = [arm, make_mesh(name, config, bones)]
+	if(config['lods']):
+		objects.append(make_mesh("lod1_" + name, config, bones))
+	for o in objects[1:]:
+		o.parent = arm
+		modifier = o.modifiers.new(name="Armature", type='ARMATURE')
+		modifier.object = arm
+
+	bpy.ops.object.select_all(action='DESELECT')
+	for o in objects:
+		o.select_set(True)
+	bpy.ops.export_scene.fbx(filepath=fbx_path, use_selection=True, add_leaf_bones=False, bake_anim=False)
+	bpy.data.batch_remove(objects)
+
+	write_xml(fbx_path.replace(".fbx", ".xml"), piece, config['materials'])
+
+def generate_character(folder, uncook_path, config):
+	print("Generating synthetic character: " + folder)
+	bpy.ops.wm.read_homefile(use_empty=True)
+	os.makedirs(folder, exist_ok=True)
+	for name in os.listdir(folder):
+		if(name.endswith(".fbx") or name.endswith(".xml")):
+			os.remove(os.path.join(folder, name))
+	# The texture folder only has generated textures, which may be from another config.
+	shutil.rmtree(os.path.join(uncook_path, os.path.dirname(texture_value(0, 0, 'd'))), ignore_errors=True)
+
+	bones = bone_names(config['bones'])
+	written = set()		# Normal maps are shared between pieces.
+	for piece in range(config['pieces']):
+		generate_piece(folder, piece, config, bones)
+		for m in range(config['materials']):
+			for name, type, value in material_params(piece, m):
+				if(type == 'handle:ITexture' and value not in written):
+					write_texture(uncook_path, value, config['texture_size'], seed=piece*1000 + m)
+					written.add(value)
+
+	with open(os.path.join(folder, "benchmark_config.json"), 'w') as f:
+		json.dump(config, f, indent=1)
+
+def is_generated(folder, config):
+	try:
+		with open(os.path.join(folder, "benchmark_config.json")) as f:
+			return json.load(f) == config
+	except (OSError, ValueError):
+		return False
+
+def run_import(folder, uncook_path):
+	# Imports the folder into an empty scene. Returns the total time and the time of every stage and the counters.
+	bpy.ops.wm.read_homefile(use_empty=True)
+	batch_cli.ensure_addon_enabled()
+
+	start = time.perf_counter()
+	import_witcher3_fbx.batch_import_w3_fbx(folder, uncook_path, "Synthetic")
+	elapsed = time.perf_counter() - start
+
+	total = import_profiler.profiler.totals()
+	return {
+		'time' : elapsed,
+		'stages' : {name : stage['time'] for name, stage in total['stages'].items()},
+		'counters' : total['counters'],
+	}
+
+def summarize(runs):
+	# Median of each stage over the runs, which is less affected by a slow first run (disk cache) than the mean.
+	stages = set(name for run in runs for name in run['stages'])
+	return {
+		'time' : statistics.median(run['time'] for run in runs),
+		'stages' : {name : statistics.median(run['stages'].get(name, 0.0) for run in runs) for name in sorted(stages)},
+	}
+
+def find_regressions(median, baseline, threshold):
+	# Returns (stage, old time, new time) of the stages that got more than threshold times slower than in the baseline results.
+	old_times = dict(baseline['median']['stages'])
+	old_times['total'] = baseline['median']['time']
+	new_times = dict(median['stages'])
+	new_times['total'] = median['time']
+	regressions = []
+	for name, new in sorted(new_times.items()):
+		old = old_times.get(name)
+		if(old == None): continue
+		if(new > old*threshold and new - old > MIN_REGRESSION_TIME):
+			regressions.append( (name, old, new) )
+	return regressions
+
+def main(argv=None):
+	if(argv == None):
+		argv = batch_cli.script_argv()
+	args = parse_args(argv)
+
+	folder = os.path.join(args.output, "synthetic_character")
+	uncook_path = os.path.join(args.output, "Uncooked")
+	config = generator_config(args)
+	if(args.regenerate or not is_generated(folder, config)):
+		generate_character(folder, uncook_path, config)
+
+	runs = []
+	for i in range(args.runs):
+		print("Benchmark run %d/%d" %(i+1, args.runs))
+		runs.append(run_import(folder, uncook_path))
+
+	results = {
+		'config' : config,
+		'blender' : bpy.app.version_string,
+		'date' : time.strftime("%Y-%m-%d %H:%M:%S"),
+		'runs' : runs,
+		'median' : summarize(runs),
+	}
+	results_path = os.path.join(args.output, time.strftime("benchmark_%Y%m%d_%H%M%S.json"))
+	with open(results_path, 'w') as f:
+		json.dump(results, f, indent=1)
+
+	median = results['median']
+	print("Benchmark: %.2fs median of %d runs" %(median['time'], len(runs)))
+	for name, t in sorted(median['stages'].items(), key=lambda item: -item[1]):
+		print("    %-24s %8.3fs" %(name, t))
+	print("Results saved: " + results_path)
+
+	if(args.compare):
+		with open(args.compare) as f:
+			baseline = json.load(f)
+		if(baseline['config'] != config):
+			print("Warning: the compared results were made with different generator settings.")
+		regressions = find_regressions(median, baseline, args.threshold)
+		for name, old, new in regressions:
+			print("REGRESSION: %s %.3fs -> %.3fs" %(name, old, new))
+		if(len(regressions) > 0):
+			sys.exit(1)
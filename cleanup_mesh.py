@@ -1,6 +1,20 @@
 import bpy
 from math import pi
 import bmesh
+import numpy as np
+from .weighted_normals import calc_weighted_normals_numpy
+from . import import_profiler
+
+def find_unused_uv_layers(mesh):
+	# Returns the indices of UV layers where every UV's X coordinate is 0, which is how unused UV maps come out of wcc_lite.
+	# Reads the UVs in bulk, so the mesh has to be in object mode.
+	unused = []
+	uvs = np.empty(len(mesh.loops)*2, dtype=np.float32)
+	for uv_idx, uv_layer in enumerate(mesh.uv_layers):
+		uv_layer.data.foreach_get('uv', uvs)
+		if(not np.any(uvs[0::2])):
+			unused.append(uv_idx)
+	return unused
 
 def cleanup_mesh(obj, 
 		remove_doubles=False, 
@@ -35,32 +49,20 @@ def cleanup_mesh(obj,
 	bpy.context.view_layer.objects.active = obj	# Active object needs to be a mesh for calculate_weighted_normals()
 	if(weight_normals and remove_doubles):	# Weight normals only works with remove doubles, otherwise throws ZeroDivisionError.
 		bpy.ops.object.calculate_weighted_normals()
-	bpy.ops.object.mode_set(mode='EDIT')
+	
+	mesh = obj.data
 	
 	### Removing useless UVMaps
 	if(clear_unused_UVs):
-		mesh = obj.data
-		bm = bmesh.from_edit_mesh(mesh)
-
-		for uv_idx in reversed(range(0, len(mesh.uv_layers))):			# For each UV layer
-			delet_this=True
-			mesh.uv_layers.active_index = uv_idx
-			bm.faces.ensure_lookup_table()
-			for f in bm.faces:						# For each face
-				for l in f.loops:					# For each loop(whatever that means)
-					if(l[bm.loops.layers.uv.active].uv[0] != 0.0):	# If the loop's UVs first vert's x coord is NOT 0
-						delet_this=False
-				if(delet_this):
-					break
-			if(delet_this):
-				obj.data.uv_layers.remove(obj.data.uv_layers[uv_idx])
-	
-		bmesh.update_edit_mesh(mesh, True)
+		for uv_idx in reversed(find_unused_uv_layers(mesh)):
+			mesh.uv_layers.remove(mesh.uv_layers[uv_idx])
 		
 	# Renaming single UV maps
 	if(len(mesh.uv_layers)==1 and rename_single_UV):
 		mesh.uv_layers[0].name = 'UVMap'
 	
+	bpy.ops.object.mode_set(mode='EDIT')
+	
 	# Seams from islands
 	if(seams_from_islands):
 		bpy.ops.uv.seams_from_islands(mark_seams=True, mark_sharp=False)
@@ -72,6 +74,80 @@ def cleanup_mesh(obj,
 	bpy.context.view_layer.objects.active = org_active
 	bpy.ops.object.mode_set(mode=org_mode)
 	
+def mark_seams_from_uv_islands(bm, uv_layer, threshold=1e-5):
+	# Marks edges as seams where the faces on either side of the edge don't share the same UVs, same as bpy.ops.uv.seams_from_islands().
+	threshold_sq = threshold * threshold
+	for e in bm.edges:
+		if(len(e.link_loops) < 2): continue	# Boundary edges don't separate islands.
+		v0 = e.verts[0]
+		first = None
+		for l in e.link_loops:
+			# A loop belongs to one vertex of the edge, the next loop in the face belongs to the other one.
+			if(l.vert == v0):
+				uvs = (l[uv_layer].uv, l.link_loop_next[uv_layer].uv)
+			else:
+				uvs = (l.link_loop_next[uv_layer].uv, l[uv_layer].uv)
+			if(first == None):
+				first = uvs
+			elif((uvs[0]-first[0]).length_squared > threshold_sq or (uvs[1]-first[1]).length_squared > threshold_sq):
+				e.seam = True
+				break
+
+def cleanup_mesh_bmesh(obj, 
+		remove_doubles=False, 
+		quadrangulate=False, 
+		weight_normals=True, 
+		seams_from_islands=True, 
+		clear_unused_UVs=True, 
+		rename_single_UV=True):
+	# Does the same as cleanup_mesh(), but without operators or mode switching. The mesh is converted to a single BMesh, cleaned up, and written back once.
+	# The object needs to be in object mode.
+	mesh = obj.data
+	
+	### Removing useless UVMaps (before creating the BMesh so it doesn't have to carry them)
+	if(clear_unused_UVs):
+		for uv_idx in reversed(find_unused_uv_layers(mesh)):
+			mesh.uv_layers.remove(mesh.uv_layers[uv_idx])
+	
+	# Renaming single UV maps
+	if(len(mesh.uv_layers)==1 and rename_single_UV):
+		mesh.uv_layers[0].name = 'UVMap'
+	
+	bm = bmesh.new()
+	bm.from_mesh(mesh)
+	
+	if(quadrangulate):
+		# Same thresholds as bpy.ops.mesh.tris_convert_to_quads(shape_threshold=1.0472, uvs=True, materials=True)
+		bmesh.ops.join_triangles(bm, faces=bm.faces[:], 
+			cmp_seam=False, cmp_sharp=False, cmp_uvs=True, cmp_vcols=False, cmp_materials=True, 
+			angle_face_threshold=0.698132, angle_shape_threshold=1.0472)
+	
+	if(remove_doubles):
+		bmesh.ops.remove_doubles(bm, verts=bm.verts[:], dist=0.0001)
+		for e in bm.edges:
+			e.smooth = True
+	
+	# Seams from islands
+	if(seams_from_islands):
+		uv_layer = bm.loops.layers.uv.active
+		if(uv_layer != None):
+			mark_seams_from_uv_islands(bm, uv_layer)
+	
+	bm.to_mesh(mesh)
+	bm.free()
+	mesh.update()
+	
+	# Setting auto-smooth to 180 so clearing the custom normals doesn't leave any edges looking sharp.
+	mesh.use_auto_smooth = True
+	mesh.auto_smooth_angle = pi
+	if(mesh.has_custom_normals):
+		# Zero vectors reset the custom normals to the automatic ones.
+		mesh.normals_split_custom_set([(0.0, 0.0, 0.0)] * len(mesh.loops))
+	
+	if(weight_normals and remove_doubles):
+		with import_profiler.stage('weighted_normals'):
+			calc_weighted_normals_numpy(mesh)
+
 class CleanUpMesh(bpy.types.Operator):
 	"""Clean up meshes"""
 	bl_idname = "object.mesh_cleanup"
@@ -114,10 +190,19 @@ class CleanUpMesh(bpy.types.Operator):
 		default=True
 	)
 	
+	use_bmesh: bpy.props.BoolProperty(
+		name="Single BMesh Pass",
+		description="Do the whole clean up on one BMesh per mesh instead of running operators in edit mode. Much faster",
+		default=True
+	)
 	
 	def execute(self, context):
+		if(self.use_bmesh):
+			bpy.ops.object.mode_set(mode='OBJECT')
 		for o in bpy.context.selected_objects:
-			cleanup_mesh(o, 
+			if(o.type != 'MESH'): continue
+			cleanup_func = cleanup_mesh_bmesh if self.use_bmesh else cleanup_mesh
+			cleanup_func(o, 
 				self.remove_doubles, 
 				self.quadrangulate, 
 				self.weight_normals, 
@@ -0,0 +1,93 @@
+# Blender Witcher 3 Importer Add-on
+# Copyright (C) 2019 Mets3D
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Pool of the texture images used by imported materials, keyed by their normalized absolute path.
+# Textures shared between materials and characters (eyes, skin details, hair masks) are only loaded and set up once.
+
+import bpy
+import os
+from . import import_profiler
+
+def texture_key(path):
+	return os.path.normcase(os.path.abspath(path))
+
+def setup_image(img, path, non_color):
+	# Moving images to local textures folder
+	if(bpy.data.is_saved and len(img.packed_files) > 0):
+		img.pack()
+		img.unpack(method='WRITE_LOCAL')
+	# Named from the path as given rather than the key, which is lowercase on Windows.
+	img.name = os.path.splitext(os.path.basename(path))[0]
+	# Setting color space and alpha mode (TODO: fix this when it gets broken by https://developer.blender.org/T60990)
+	if(non_color):
+		img.colorspace_settings.name = 'Non-Color'
+		img.alpha_mode = 'CHANNEL_PACKED'
+	else:
+		img.alpha_mode = 'STRAIGHT'
+
+class ImagePool:
+	def __init__(self):
+		self.images = {}	# Texture key : image name
+		self.users = {}		# Texture key : number of materials using the image
+
+	def find(self, key):
+		name = self.images.get(key)
+		if(name == None):
+			return None
+		img = bpy.data.images.get(name)
+		# Images store their source path, since unpacking them changes their filepath.
+		if(img == None or img.get('witcher3_source_path') != key):
+			del self.images[key]
+			return None
+		return img
+
+	def get(self, path, non_color=False):
+		# Returns the image of a texture file, loading it the first time it's requested.
+		key = texture_key(path)
+		img = self.find(key)
+		if(img != None):
+			import_profiler.count('textures_reused')
+			return img
+
+		img = bpy.data.images.load(path, check_existing=True)
+		if(img.get('witcher3_source_path') != key):
+			img['witcher3_source_path'] = key
+			img['witcher3_original_path'] = path
+			setup_image(img, path, non_color)
+			import_profiler.count('textures_loaded')
+		else:
+			# Loaded in an earlier session.
+			import_profiler.count('textures_reused')
+		self.images[key] = img.name
+		return img
+
+	def add_user(self, path):
+		key = texture_key(path)
+		self.users[key] = self.users.get(key, 0) + 1
+
+	def memory(self):
+		# Bytes used by the pixels of the images that are loaded into memory.
+		total = 0
+		for key in list(self.images):
+			img = self.find(key)
+			if(img == None or not img.has_data): continue
+			bytes_per_channel = 4 if img.is_float else 1
+			total += img.size[0] * img.size[1] * img.channels * bytes_per_channel
+		return total
+
+	def print_report(self):
+		references = sum(self.users.values())
+		print("Image pool: %d images, %d material references, %.1f MB in memory" %(len(self.images), references, self.memory() / (1024*1024)))
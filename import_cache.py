@@ -0,0 +1,127 @@
+# Blender Witcher 3 Importer Add-on
+# Copyright (C) 2019 Mets3D
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Cache of processed FBX imports. The objects resulting from importing an FBX are written to a .blend file named after a hash of
+# the FBX and XML contents and the import options. Importing the same file with the same options again appends the objects from there.
+# The least recently used files are deleted when the cache gets bigger than max_size.
+
+import bpy
+import os
+import re
+import json
+import hashlib
+
+CACHE_VERSION = 1	# Increase this when the import pipeline changes in a way that makes old cached results wrong.
+max_size = 2048 * 1024 * 1024	# In bytes.
+
+def get_cache_dir():
+	return bpy.utils.user_resource('CONFIG', path="witcher3_import_cache", create=True)
+
+def cache_key(fbx_path, xml_path, options):
+	h = hashlib.sha1()
+	h.update(str(CACHE_VERSION).encode('utf-8'))
+	for path in (fbx_path, xml_path):
+		if(not os.path.isfile(path)):
+			h.update(b'missing')
+			continue
+		with open(path, 'rb') as f:
+			for chunk in iter(lambda: f.read(1024*1024), b''):
+				h.update(chunk)
+	h.update(json.dumps(options, sort_keys=True).encode('utf-8'))
+	return h.hexdigest()
+
+def cache_path(key):
+	return os.path.join(get_cache_dir(), key + ".blend")
+
+def merge_duplicates(new_ids, collection, key_func):
+	# Appending creates a copy of datablocks that already exist in the file (with a .001 suffix). Replace them with the existing ones.
+	new_ids = set(new_ids)
+	existing = {}
+	for datablock in collection:
+		if(datablock in new_ids): continue
+		key = key_func(datablock)
+		if(key != None):
+			existing[key] = datablock
+	removed = []
+	for datablock in new_ids:
+		match = existing.get(key_func(datablock))
+		if(match != None):
+			datablock.user_remap(match)
+			removed.append(datablock)
+	for datablock in removed:
+		collection.remove(datablock)
+
+def node_group_key(ng):
+	return re.sub(r"\.\d\d\d$", "", ng.name)
+
+def image_key(img):
+	return os.path.normcase(bpy.path.abspath(img.filepath)) if img.filepath else None
+
+def material_key(mat):
+	return mat.get('witcher3_mat_hash')
+
+def load(key):
+	# Returns [meshes, armatures] appended from the cache, or None if this key isn't cached.
+	path = cache_path(key)
+	if(not os.path.isfile(path)):
+		return None
+	os.utime(path)	# Marking as recently used.
+
+	old_node_groups = set(bpy.data.node_groups)
+	old_images = set(bpy.data.images)
+	old_materials = set(bpy.data.materials)
+
+	with bpy.data.libraries.load(path) as (data_from, data_to):
+		data_to.objects = data_from.objects
+
+	merge_duplicates(set(bpy.data.node_groups) - old_node_groups, bpy.data.node_groups, node_group_key)
+	merge_duplicates(set(bpy.data.images) - old_images, bpy.data.images, image_key)
+	merge_duplicates(set(bpy.data.materials) - old_materials, bpy.data.materials, material_key)
+
+	meshes = []
+	armatures = []
+	for o in data_to.objects:
+		if(o == None): continue
+		bpy.context.collection.objects.link(o)
+		if(o.type == 'MESH'):
+			meshes.append(o)
+		elif(o.type == 'ARMATURE'):
+			armatures.append(o)
+	return [meshes, armatures]
+
+def store(key, objects):
+	path = cache_path(key)
+	tmp_path = path + ".tmp"
+	bpy.data.libraries.write(tmp_path, set(objects))
+	os.replace(tmp_path, path)
+	evict(max_size)
+
+def evict(size):
+	# Delete the least recently used cache files until the cache is smaller than size.
+	cache_dir = get_cache_dir()
+	entries = []
+	for name in os.listdir(cache_dir):
+		if(not name.endswith(".blend")): continue
+		st = os.stat(os.path.join(cache_dir, name))
+		entries.append((st.st_mtime, st.st_size, name))
+	total = sum(e[1] for e in entries)
+	for mtime, file_size, name in sorted(entries):
+		if(total <= size): break
+		os.remove(os.path.join(cache_dir, name))
+		total -= file_size
+
+def clear():
+	evict(0)
@@ -0,0 +1,243 @@
+# Blender Witcher 3 Importer Add-on
+# Copyright (C) 2019 Mets3D
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Dry run of a batch import: lists what batch_import_w3_fbx() would import from a character folder without importing anything.
+# FBX/XML pairs, materials per shader family, referenced and missing textures, LOD meshes, and an estimate of the import time.
+# Only reads files, on a thread pool. This file must not import bpy.
+
+import os
+import re
+import json
+from concurrent.futures import ThreadPoolExecutor
+from .material_xml import read_materials
+from .material_recipe import MATERIAL_MAIN, MATERIAL_SKIN, MATERIAL_HAIR, MATERIAL_EYE, shader_type_of
+
+# Seconds per unit of work, used by estimate_time(). These are rough defaults, rates_from_report() measures them from a saved import report (batch_cli.py --rates-from).
+DEFAULT_RATES = {
+	'fbx_mb' : 1.5,		# Importing and cleaning up a MB of FBX.
+	'material' : 0.05,	# Building one material.
+	'texture' : 0.1,	# Loading one texture.
+}
+
+# Object names in binary FBX files are stored as "name\x00\x01Model", and in ASCII ones as "Model::name". Same for materials.
+binary_model_re = re.compile(rb"([\x20-\x7e]+)\x00\x01Model")
+ascii_model_re = re.compile(rb'"Model::([^"]*)"')
+binary_material_re = re.compile(rb"([\x20-\x7e]+)\x00\x01Material")
+ascii_material_re = re.compile(rb'"Material::([^"]*)"')
+# Objects with their int64 ID, and "OO" connections of a child object ID to a parent object ID, which link materials to their models.
+binary_object_re = re.compile(rb"L(.{8})S.{4}([\x20-\x7e]*)\x00\x01(Model|Material)", re.DOTALL)
+ascii_object_re = re.compile(rb'(?:Model|Material): *(-?\d+), *"(Model|Material)::([^"]*)"')
+binary_connection_re = re.compile(rb"S\x02\x00\x00\x00OOL(.{8})L(.{8})", re.DOTALL)
+ascii_connection_re = re.compile(rb'C: *"OO", *(-?\d+), *(-?\d+)')
+lod_re = re.compile(r"lod[123]")
+# Same as fbx_material_re and xml_material_re in import_witcher3_fbx.py, which match XML materials to FBX materials by their number.
+fbx_material_re = re.compile(r"Material(\d+)$")
+xml_material_re = re.compile(r"(\d+)$")
+
+def collect_filepaths(paths, recursive=False):
+	# Same as batch_import_w3_fbx(): paths is a list of files, or a folder.
+	if(type(paths)==list):
+		return paths[:]
+	filepaths = []
+	for subdir, dirs, files in os.walk(paths):
+		for file in files:
+			filepaths.append(subdir + os.sep + file)
+		if(not recursive): break
+	return filepaths
+
+def shader_family(mat_base):
+	if(mat_base == None):
+		return 'unknown'
+	shader_type = shader_type_of(mat_base)
+	if(shader_type in MATERIAL_SKIN):	return 'skin'
+	if(shader_type in MATERIAL_HAIR):	return 'hair'
+	if(shader_type in MATERIAL_EYE):	return 'eye'
+	if(shader_type in MATERIAL_MAIN):	return 'main'
+	return 'other'
+
+def fbx_object_names(fbx_path):
+	# Returns the model names and the material names of an FBX file, and the names of the materials used by non-LOD models.
+	# The last one is None if the materials couldn't be linked to models (no connections found, or an older FBX version that links by name).
+	with open(fbx_path, 'rb') as f:
+		data = f.read()
+	models = binary_model_re.findall(data) + ascii_model_re.findall(data)
+	materials = binary_material_re.findall(data) + ascii_material_re.findall(data)
+	models, materials = [sorted(set(name.decode('utf-8', 'replace') for name in names)) for names in (models, materials)]
+
+	objects = {}	# ID : (class, name)
+	for id, name, cls in binary_object_re.findall(data):
+		objects[id] = (cls, name.decode('utf-8', 'replace'))
+	for id, cls, name in ascii_object_re.findall(data):
+		objects[id] = (cls, name.decode('utf-8', 'replace'))
+	lod0_materials = set()
+	linked = False
+	for child, parent in binary_connection_re.findall(data) + ascii_connection_re.findall(data):
+		child, parent = objects.get(child), objects.get(parent)
+		if(child == None or parent == None or child[0] != b'Material' or parent[0] != b'Model'): continue
+		linked = True
+		if(not lod_re.search(parent[1])):
+			lod0_materials.add(child[1])
+	if(not linked and len(materials) > 0):
+		return models, materials, None
+	return models, materials, sorted(lod0_materials)
+
+def is_lod_material(mat_name, fbx_numbers):
+	# XML materials without an FBX material of the same number on a non-LOD model belong to the LOD meshes, load_w3_materials() never builds them.
+	# Without FBX materials to compare to, nothing is assumed to be a LOD material.
+	if(len(fbx_numbers) == 0):
+		return False
+	match = xml_material_re.search(mat_name or "")
+	return match == None or int(match.group(1)) not in fbx_numbers
+
+def inspect_pair(fbx_path):
+	# Reads one FBX/XML pair. Errors are stored in the result instead of raised, so one broken file doesn't stop the plan.
+	xml_path = fbx_path.replace(".fbx", ".xml")
+	entry = {
+		'fbx' : fbx_path,
+		'xml' : xml_path if os.path.isfile(xml_path) else None,
+		'fbx_size' : 0,
+		'models' : [],
+		'lod_models' : [],
+		'materials' : [],
+		'materials_linked' : True,	# Whether FBX materials could be linked to their models, otherwise LOD materials are only the ones missing from the FBX.
+		'errors' : [],
+	}
+	fbx_numbers = set()
+	try:
+		entry['fbx_size'] = os.path.getsize(fbx_path)
+		models, materials, lod0_materials = fbx_object_names(fbx_path)
+		entry['models'] = [m for m in models if not lod_re.search(m)]
+		entry['lod_models'] = [m for m in models if lod_re.search(m)]
+		if(lod0_materials != None):
+			materials = lod0_materials
+		else:
+			entry['materials_linked'] = False
+		fbx_numbers = set(int(match.group(1)) for match in map(fbx_material_re.search, materials) if match != None)
+	except OSError as e:
+		entry['errors'].append("Could not read FBX: " + str(e))
+	if(entry['xml'] == None):
+		entry['errors'].append("Missing XML: " + xml_path)
+		return entry
+	try:
+		for mat_data in read_materials(xml_path):
+			textures = [p.value for p in mat_data.params if p.type == 'handle:ITexture' and p.value not in (None, 'NULL')]
+			entry['materials'].append({'name' : mat_data.name, 'base' : mat_data.base, 'family' : shader_family(mat_data.base), 'textures' : textures,
+				'lod' : is_lod_material(mat_data.name, fbx_numbers)})
+	except Exception as e:
+		entry['errors'].append("Could not parse XML: " + str(e))
+	return entry
+
+def plan_import(paths, uncook_path, recursive=False, texture_index=None, rates=None, workers=8):
+	# Returns the plan of importing paths (a list of files or a folder) as a JSON compatible dictionary.
+	# With a TextureIndex, textures are looked up in it, otherwise their files are checked on the disk.
+	filepaths = collect_filepaths(paths, recursive)
+	fbx_paths = [p for p in filepaths if p.endswith(".fbx")]
+
+	with ThreadPoolExecutor(max_workers=workers) as executor:
+		files = list(executor.map(inspect_pair, fbx_paths))
+
+		# Textures of LOD materials are only checked for the report, they are never loaded.
+		tex_values = set(t for entry in files for mat in entry['materials'] if not mat['lod'] for t in mat['textures'])
+		lod_tex_values = set(t for entry in files for mat in entry['materials'] if mat['lod'] for t in mat['textures']) - tex_values
+		all_values = sorted(tex_values | lod_tex_values)
+		rel_paths = [value.replace(".xbm", ".tga") for value in all_values]
+		if(texture_index != None):
+			found = [texture_index.resolve(rel_path) != None for rel_path in rel_paths]
+		else:
+			found = list(executor.map(lambda rel_path: os.path.isfile(uncook_path + os.sep + rel_path), rel_paths))
+	missing = [rel_path for value, rel_path, exists in zip(all_values, rel_paths, found) if not exists and value in tex_values]
+	lod_missing = [rel_path for value, rel_path, exists in zip(all_values, rel_paths, found) if not exists and value in lod_tex_values]
+
+	families = {}
+	lod_materials = 0
+	for entry in files:
+		for mat in entry['materials']:
+			if(mat['lod']):
+				lod_materials += 1
+				continue
+			families[mat['family']] = families.get(mat['family'], 0) + 1
+
+	plan = {
+		'uncook_path' : uncook_path,
+		'files' : files,
+		'skipped_files' : [p for p in filepaths if not p.endswith(".fbx") and not p.endswith(".xml")],
+		'summary' : {
+			'fbx_files' : len(fbx_paths),
+			'fbx_mb' : sum(entry['fbx_size'] for entry in files) / (1024*1024),
+			'missing_xmls' : sum(1 for entry in files if entry['xml'] == None),
+			'materials' : sum(families.values()),
+			'shader_families' : families,
+			'textures' : len(tex_values),
+			'missing_textures' : len(missing),
+			'lod_models' : sum(len(entry['lod_models']) for entry in files),
+			'lod_materials' : lod_materials,
+			'lod_missing_textures' : len(lod_missing),
+			'unlinked_fbx_files' : sum(1 for entry in files if not entry['materials_linked']),
+			'errors' : sum(len(entry['errors']) for entry in files),
+		},
+		'missing_textures' : missing,
+		'lod_missing_textures' : lod_missing,
+	}
+	plan['summary']['estimated_seconds'] = estimate_time(plan, rates)
+	return plan
+
+def estimate_time(plan, rates=None):
+	rates = rates if rates != None else DEFAULT_RATES
+	summary = plan['summary']
+	found_textures = summary['textures'] - summary['missing_textures']
+	return summary['fbx_mb']*rates['fbx_mb'] + summary['materials']*rates['material'] + found_textures*rates['texture']
+
+def rates_from_report(report_path):
+	# Measures the rates of estimate_time() from an import report saved by ImportProfiler.save_report(). Rates that can't be measured keep their default.
+	with open(report_path) as f:
+		report = json.load(f)
+	rates = dict(DEFAULT_RATES)
+	fbx_bytes = 0
+	fbx_time = 0.0
+	for rec in report['files']:
+		if(not os.path.isfile(rec['name'])): continue
+		fbx_bytes += os.path.getsize(rec['name'])
+		fbx_time += sum(rec['stages'].get(name, {'time' : 0.0})['time'] for name in ['fbx_import', 'lod_removal', 'cleanup_mesh', 'armature_cleanup'])
+	if(fbx_bytes > 0):
+		rates['fbx_mb'] = fbx_time / (fbx_bytes / (1024*1024))
+	total = report['total']
+	materials = total['counters'].get('materials', 0)
+	textures = total['counters'].get('textures_loaded', 0)
+	material_time = total['stages'].get('materials', {'time' : 0.0})['time']
+	texture_time = total['stages'].get('texture_load', {'time' : 0.0})['time']
+	if(textures > 0):
+		rates['texture'] = texture_time / textures
+	if(materials > 0):
+		rates['material'] = max(material_time - texture_time, 0.0) / materials
+	return rates
+
+def save_plan(plan, filepath):
+	with open(filepath, 'w') as f:
+		json.dump(plan, f, indent=1)
+
+def print_plan(plan):
+	summary = plan['summary']
+	print("Import plan: %d FBX files (%.1f MB), estimated %.0fs" %(summary['fbx_files'], summary['fbx_mb'], summary['estimated_seconds']))
+	print("    Materials: %d (%s)" %(summary['materials'], ", ".join("%s: %d" %item for item in sorted(summary['shader_families'].items()))))
+	print("    Textures: %d, missing: %d" %(summary['textures'], summary['missing_textures']))
+	print("    LOD models: %d, LOD materials: %d, missing LOD textures: %d" %(summary['lod_models'], summary['lod_materials'], summary['lod_missing_textures']))
+	if(summary['unlinked_fbx_files'] > 0):
+		print("    Materials of %d FBX files couldn't be linked to their models, their LOD materials may be counted as used." %summary['unlinked_fbx_files'])
+	for rel_path in plan['missing_textures']:
+		print("    Missing texture: " + rel_path)
+	for entry in plan['files']:
+		for error in entry['errors']:
+			print("    %s: %s" %(os.path.basename(entry['fbx']), error))
@@ -0,0 +1,126 @@
+# Blender Witcher 3 Importer Add-on
+# Copyright (C) 2019 Mets3D
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Timing of the import pipeline stages, and counters like vertices, materials and textures.
+# It only takes a perf_counter() call per stage, so it's always on.
+#
+# Usage:
+#	with import_profiler.stage('cleanup_mesh'):
+#		...
+#	import_profiler.count('vertices', len(mesh.vertices))
+
+import time
+import json
+from contextlib import contextmanager
+
+def new_record(name):
+	return {'name' : name, 'time' : 0.0, 'stages' : {}, 'counters' : {}}
+
+class ImportProfiler:
+	def __init__(self):
+		self.files = []			# One record per imported file.
+		self.batch = new_record('batch')	# Stages that don't belong to a single file, like combining armatures.
+		self.current = None		# Record of the file being imported.
+		self.file_start = 0.0
+		self.start = time.perf_counter()
+		self.end = None
+
+	def record(self):
+		return self.current if self.current != None else self.batch
+
+	def begin_file(self, filepath):
+		self.current = new_record(filepath)
+		self.files.append(self.current)
+		self.file_start = time.perf_counter()
+
+	def end_file(self):
+		if(self.current == None): return
+		self.current['time'] = time.perf_counter() - self.file_start
+		self.current = None
+
+	@contextmanager
+	def stage(self, name):
+		# Stages can be nested, in which case the time is counted in both.
+		start = time.perf_counter()
+		try:
+			yield
+		finally:
+			stages = self.record()['stages']
+			stage = stages.get(name)
+			if(stage == None):
+				stage = stages[name] = {'time' : 0.0, 'calls' : 0}
+			stage['time'] += time.perf_counter() - start
+			stage['calls'] += 1
+
+	def count(self, name, amount=1):
+		counters = self.record()['counters']
+		counters[name] = counters.get(name, 0) + amount
+
+	def finish(self):
+		self.end_file()
+		self.end = time.perf_counter()
+
+	def totals(self):
+		# Stages and counters summed over all files and the batch level stages.
+		total = new_record('total')
+		for rec in self.files + [self.batch]:
+			total['time'] += rec['time']
+			for name, stage in rec['stages'].items():
+				t = total['stages'].setdefault(name, {'time' : 0.0, 'calls' : 0})
+				t['time'] += stage['time']
+				t['calls'] += stage['calls']
+			for name, amount in rec['counters'].items():
+				total['counters'][name] = total['counters'].get(name, 0) + amount
+		end = self.end if self.end != None else time.perf_counter()
+		total['time'] = end - self.start
+		return total
+
+	def report(self):
+		return {
+			'files' : self.files,
+			'batch' : self.batch,
+			'total' : self.totals(),
+		}
+
+	def save_report(self, filepath):
+		with open(filepath, 'w') as f:
+			json.dump(self.report(), f, indent=1)
+
+	def print_summary(self):
+		total = self.totals()
+		print("Import report: %d files in %.2fs" %(len(self.files), total['time']))
+		for name, stage in sorted(total['stages'].items(), key=lambda item: -item[1]['time']):
+			print("    %-24s %8.3fs  %5d calls" %(name, stage['time'], stage['calls']))
+		for name, amount in sorted(total['counters'].items()):
+			print("    %-24s %8d" %(name, amount))
+		for rec in self.files:
+			if(len(rec['stages']) == 0): continue
+			slowest = max(rec['stages'].items(), key=lambda item: item[1]['time'])
+			print("    %.2fs (slowest: %s %.2fs) %s" %(rec['time'], slowest[0], slowest[1]['time'], rec['name']))
+
+# The profiler of the current import session.
+profiler = ImportProfiler()
+
+def reset():
+	global profiler
+	profiler = ImportProfiler()
+	return profiler
+
+def stage(name):
+	return profiler.stage(name)
+
+def count(name, amount=1):
+	profiler.count(name, amount)
@@ -17,13 +17,24 @@
 import bpy
 import os
 import bmesh
-import xml.etree.ElementTree as ET
 import sys
+import re
+import hashlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future
 from mathutils import Vector
 from mathutils import Euler
 from math import pi
 from bpy.props import *
 from . import cleanup_mesh
+from .texture_index import TextureIndex
+from . import import_profiler
+from . import import_cache
+from . import import_planner
+from .image_pool import ImagePool
+from . import tga_preview
+from .material_xml import W3Param, read_materials
+from .material_recipe import compile_recipe, shader_type_of, recipe_signature
 from bpy_extras.io_utils import ImportHelper
 from bpy.types import Operator
 
@@ -35,6 +46,60 @@ from bpy.types import Operator
 class W3ImporterError(Exception):
 	pass
 
+# Duplicate material index, maps material_hash() to material name. Built lazily once per import session, see reset_import_session().
+material_index = None
+
+# XML files being parsed in the background by prefetch_xmls(), maps .xml path to a Future of read_materials_and_recipes().
+# Entries are kept until import_w3_fbx_file() is done with the FBX, since every mesh of the FBX reads the same XML.
+xml_cache = {}
+xml_executor = None
+
+# Uncooked folder texture indices, maps uncook path to TextureIndex. They are kept between sessions, but refreshed once per session.
+texture_indices = {}
+refreshed_texture_indices = set()
+
+# Material recipes compiled in this session, by material hash. Filled by setup_w3_material() and read_cached_xml(), only on the main thread.
+recipe_cache = {}
+
+# Materials of this session to copy for materials with the same node structure, as recipe signature : (material name, node names in recipe order).
+# See copy_material_template().
+material_templates = {}
+
+# Images of the textures loaded in this session.
+image_pool = ImagePool()
+
+# Future of a {texture path : Future of a {texture path : preview path} dictionary} dictionary, when this session uses downscaled textures.
+# The inner futures are shared by the textures that are made by the same worker process. See start_texture_previews().
+texture_previews = None
+preview_executor = None
+preview_error_reported = False
+preview_factor = 1
+
+# Texture resolutions, as the factor textures are downscaled by.
+TEXTURE_RESOLUTIONS = {'FULL' : 1, 'HALF' : 2, 'QUARTER' : 4}
+
+def reset_import_session():
+	# Forget any state cached by a previous import, so it gets rebuilt from the current blend file.
+	global material_index, resources_loaded, image_pool, texture_previews, preview_factor, preview_error_reported
+	material_index = None
+	resources_loaded = False
+	image_pool = ImagePool()
+	texture_previews = None
+	preview_factor = 1
+	preview_error_reported = False
+	stop_xml_prefetch()
+	refreshed_texture_indices.clear()
+	recipe_cache.clear()
+	material_templates.clear()
+	import_profiler.reset()
+
+def get_addon_prefs():
+	# Returns None when the add-on isn't enabled, eg. when running from the command line.
+	addon = bpy.context.preferences.addons.get(__package__)
+	if(addon == None):
+		return None
+	return addon.preferences
+
 def enable_print(bool):	
 	# For suppressing prints from fbx importer and remove_doubles().
 	if(not bool):
@@ -42,405 +107,584 @@ def enable_print(bool):
 	else:
 		sys.stdout = sys.__stdout__
 
-def readXML(xml_path):
-	# Witcher 3 material info needs to be read from .xml files.
-	with open(xml_path, 'r') as myFile:
-		# Parsing the file directly doesn't work due to a bug in ET that rejects UTF-16, so we'll have to use fromstring().
-		data=myFile.read()
-		return ET.fromstring(data)
+def prefetch_xmls(fbx_paths, max_workers=4, uncook_path=None, use_texture_index=False):
+	# Start reading and parsing the .xml files next to these FBX files on a thread pool, so the disk and parse latency is hidden behind the FBX imports.
+	# With an uncook_path, the material recipes are compiled there too.
+	# The threads don't touch bpy. The results are picked up by read_cached_xml() and setup_w3_material().
+	global xml_executor
+	resolve_texture = texture_resolver(uncook_path, use_texture_index) if uncook_path else None
+	if(xml_executor == None):
+		xml_executor = ThreadPoolExecutor(max_workers=max_workers)
+	for fbx_path in fbx_paths:
+		if(not fbx_path.endswith(".fbx")): continue
+		xml_path = fbx_path.replace(".fbx", ".xml")
+		if(xml_path in xml_cache): continue
+		xml_cache[xml_path] = xml_executor.submit(read_materials_and_recipes, xml_path, resolve_texture)
+
+def read_cached_xml(xml_path):
+	# Returns the prefetched list of materials if there is one, otherwise reads it now. Errors from the background thread are raised here.
+	# The result stays in the cache for the other meshes of the same FBX, import_w3_fbx_file() drops it. The recipes compiled with it are added to recipe_cache.
+	future = xml_cache.get(xml_path)
+	if(future == None):
+		future = xml_cache[xml_path] = Future()
+		future.set_result( (read_materials(xml_path), {}) )
+	materials, recipes = future.result()
+	for mat_hash, recipe in recipes.items():
+		recipe_cache.setdefault(mat_hash, recipe)
+	return materials
+
+def stop_xml_prefetch():
+	global xml_executor, preview_executor
+	for future in xml_cache.values():
+		future.cancel()
+	xml_cache.clear()
+	if(xml_executor != None):
+		xml_executor.shutdown(wait=False)
+		xml_executor = None
+	if(preview_executor != None):
+		preview_executor.shutdown(wait=False)
+		preview_executor = None
 
-def append_resources():
-	# Append Witcher 3 nodegroups from the .blend file of the addon.
+# Node groups that are required to set up materials. There are more in witcher3_materials.blend, those are appended too.
+W3_NODE_GROUPS = ['Witcher3_Main', 'Witcher3_Skin', 'Witcher3_Hair']
+resources_loaded = False	# Whether append_resources() already checked the node groups this session.
+
+def get_resources_path():
 	filename = "witcher3_materials.blend"
 	filedir = os.path.dirname(os.path.realpath(__file__))
-	blend_path = os.path.join(filedir, filename)
-	
-	with bpy.data.libraries.load(blend_path) as (data_from, data_to):
+	return os.path.join(filedir, filename)
+
+def resources_fingerprint(blend_path):
+	# Changes whenever the .blend file of the addon is updated.
+	st = os.stat(blend_path)
+	return "%d:%d" %(st.st_size, int(st.st_mtime))
+
+def append_resources(link=False):
+	# Append Witcher 3 nodegroups from the .blend file of the addon, or link them with link=True.
+	# The .blend file is only opened the first time this is called in a session, or when the node groups are missing or came from an older version of it.
+	global resources_loaded
+	if(resources_loaded and all(bpy.data.node_groups.get(name) != None for name in W3_NODE_GROUPS)):
+		return
+	
+	blend_path = get_resources_path()
+	fingerprint = resources_fingerprint(blend_path)
+	
+	# Appended node groups remember the fingerprint of the file they came from.
+	stale = [ng for ng in bpy.data.node_groups if ng.library == None and ng.get('witcher3_fingerprint') not in (None, fingerprint)]
+	# Linked node groups update by reloading the library.
+	for lib in bpy.data.libraries:
+		if(os.path.normcase(bpy.path.abspath(lib.filepath)) != os.path.normcase(blend_path)): continue
+		if(lib.get('witcher3_fingerprint') != fingerprint):
+			lib.reload()
+			lib['witcher3_fingerprint'] = fingerprint
+	
+	old_node_groups = set(bpy.data.node_groups)
+	with bpy.data.libraries.load(blend_path, link=link) as (data_from, data_to):
 		for ng in data_from.node_groups:
-			if(bpy.data.node_groups.get(ng) == None):
+			existing = bpy.data.node_groups.get(ng)
+			if(existing == None or existing in stale):
 				data_to.node_groups.append(ng)
-
-def order_elements_by_attribute(elements, order, attribute='name'):
-	# Function that returns a list of Element objects ordered by the value of an attribute and an arbitrary order.
-	# Used to order nodes so that more useful input nodes are at the top of the node graph, and misc nodes are at the bottom.
-	ordered = []
-	unordered = elements[:]
-	for name in order:
-		for p in elements:
-			if(p.get('name')==name):
-				ordered.append(p)
-				if(p in unordered): 
-					unordered.remove(p)
-	ordered.extend(unordered)
-	return ordered
-
-def setup_w3_material(material, mat_data, obj):
-	# Checks for duplicate materials
-	# Saves XML data in custom properties
-	# Creates nodes
-	# Loads images
-	# TODO: This function got really long, might want to split it up.
-	addon_prefs = bpy.context.preferences.addons[__package__].preferences
-	uncook_path = addon_prefs.uncook_path
+	new_node_groups = [ng for ng in bpy.data.node_groups if ng not in old_node_groups]
 	
-	mat_base = mat_data.get('base')		# Path to the .w2mg or .w2mi file.
+	for ng in new_node_groups:
+		if(ng.library == None):
+			ng['witcher3_fingerprint'] = fingerprint
+		else:
+			ng.library['witcher3_fingerprint'] = fingerprint
+	
+	# Replacing the outdated node groups with the new ones, which got a .001 suffix on load.
+	for old_ng in stale:
+		name = old_ng.name
+		for ng in new_node_groups:
+			if(ng.name.startswith(name + ".")):
+				old_ng.user_remap(ng)
+				bpy.data.node_groups.remove(old_ng)
+				ng.name = name
+				break
+	
+	resources_loaded = True
+
+def get_texture_index(uncook_path):
+	# Returns the TextureIndex of an Uncooked folder, loading it from disk and refreshing it if this is its first use in this session.
+	index = texture_indices.get(uncook_path)
+	if(index == None):
+		index_dir = bpy.utils.user_resource('CONFIG', path="witcher3_texture_index", create=True)
+		index_name = hashlib.sha1(os.path.abspath(uncook_path).encode('utf-8')).hexdigest()[:16] + ".json"
+		index = TextureIndex(uncook_path, os.path.join(index_dir, index_name))
+		index.load()
+		texture_indices[uncook_path] = index
+	if(uncook_path not in refreshed_texture_indices):
+		print("Refreshing texture index: " + uncook_path)
+		if(index.refresh()):
+			index.save()
+		refreshed_texture_indices.add(uncook_path)
+	return index
+
+def get_placeholder_image(normal_map=False):
+	# Tiny stand-in image for textures that aren't loaded yet. Flat normal for normal maps, grey for everything else.
+	name = "W3_Placeholder_Normal" if normal_map else "W3_Placeholder"
+	img = bpy.data.images.get(name)
+	if(img == None):
+		img = bpy.data.images.new(name, 4, 4)
+		img.generated_color = (0.5, 0.5, 1.0, 1.0) if normal_map else (0.5, 0.5, 0.5, 1.0)
+		if(normal_map):
+			img.colorspace_settings.name = 'Non-Color'
+	return img
+
+def deferred_texture_nodes(materials):
+	# Returns (material name, node name) of every image node waiting for its texture to be loaded.
+	jobs = []
+	for m in materials:
+		if(m == None or m.node_tree == None): continue
+		for n in m.node_tree.nodes:
+			if(n.type == 'TEX_IMAGE' and n.get('witcher3_tex_path') != None):
+				jobs.append((m.name, n.name))
+	return jobs
+
+def load_deferred_texture(material_name, node_name):
+	# Loads the texture of an image node created with lazy_textures. Returns False if the node no longer exists.
+	m = bpy.data.materials.get(material_name)
+	if(m == None or m.node_tree == None):
+		return False
+	n = m.node_tree.nodes.get(node_name)
+	if(n == None or n.get('witcher3_tex_path') == None):
+		return False
+	img = n.image = image_pool.get(n['witcher3_tex_path'], n.get('witcher3_non_color', False))
+	if('witcher3_full_path' in n):
+		img['witcher3_full_path'] = n['witcher3_full_path']
+		img['witcher3_preview_path'] = n['witcher3_tex_path']
+	# Reading the size makes Blender decode the pixels now, rather than when the viewport first draws the image.
+	img.size[0]
+	for prop in ['witcher3_tex_path', 'witcher3_non_color', 'witcher3_full_path']:
+		if(prop in n):
+			del n[prop]
+	return True
+
+def get_python_executable():
+	# Blender 2.91 and up point sys.executable to the bundled Python, older versions have bpy.app.binary_path_python.
+	return getattr(bpy.app, 'binary_path_python', None) or sys.executable
+
+def start_texture_previews(xml_paths, uncook_path, use_texture_index, texture_resolution, workers=4, chunk_size=4):
+	# Makes downscaled previews of every texture referenced by these (prefetched) XML files, in the background.
+	# The textures are decoded by separate processes, see tga_preview.py. Missing previews are made in small chunks, in the order the textures
+	# appear in the XMLs, so get_preview_path() only has to wait for the chunk of the texture it needs.
+	global texture_previews, preview_factor, preview_executor
+	factor = TEXTURE_RESOLUTIONS[texture_resolution]
+	if(factor == 1 or xml_executor == None):
+		return
+	preview_factor = factor
+	xml_futures = [xml_cache[p] for p in xml_paths if p in xml_cache]
+	resolve_texture = texture_resolver(uncook_path, use_texture_index)
+	cache_dir = bpy.utils.user_resource('CONFIG', path="witcher3_texture_previews", create=True)
+	python_exe = get_python_executable()
+	executor = preview_executor = ThreadPoolExecutor(max_workers=workers)
+	
+	def collect():
+		tex_paths = {}	# Used as an ordered set.
+		for future in xml_futures:
+			try:
+				materials, recipes = future.result()
+			except Exception:
+				continue	# Reported when the XML is used.
+			for param in [p for mat_data in materials for p in mat_data.params]:
+				value = param.value
+				if(param.type != 'handle:ITexture' or value in (None, 'NULL')): continue
+				tex_path = resolve_texture(value)
+				if(tex_path != None):
+					tex_paths[tex_path] = True
+		
+		existing, jobs = tga_preview.plan_previews(list(tex_paths), factor, cache_dir)
+		previews = {}
+		for src_path, dst_path in existing.items():
+			done = Future()
+			done.set_result({src_path : dst_path})
+			previews[src_path] = done
+		for i in range(0, len(jobs), chunk_size):
+			chunk = jobs[i:i+chunk_size]
+			future = executor.submit(tga_preview.run_jobs, chunk, python_exe)
+			for src_path, dst_path, job_factor in chunk:
+				previews[src_path] = future
+		return previews
+	
+	texture_previews = xml_executor.submit(collect)
+
+def report_preview_error(e):
+	# Reports a failure to make texture previews once per session, instead of for every texture.
+	global preview_error_reported
+	if(not preview_error_reported):
+		print("Could not make texture previews: " + str(e))
+		preview_error_reported = True
+
+def get_preview_path(tex_path):
+	# Returns the path of the downscaled preview of a texture if this session uses previews and there is one, otherwise the texture path.
+	# Only waits for the XML files to be read and for the preview of this texture, not for the rest of the batch.
+	global texture_previews
+	if(texture_previews == None):
+		return tex_path
+	try:
+		previews = texture_previews.result()
+	except Exception as e:
+		report_preview_error(e)
+		texture_previews = None
+		return tex_path
+	future = previews.get(tex_path)
+	if(future == None):
+		return tex_path
+	try:
+		return future.result().get(tex_path, tex_path)
+	except Exception as e:
+		report_preview_error(e)
+		return tex_path
+
+def set_texture_resolution(images, use_previews):
+	# Points images that were imported with a preview between the preview and the full resolution texture. Returns how many were switched.
+	switched = 0
+	for img in images:
+		full_path = img.get('witcher3_full_path')
+		preview_path = img.get('witcher3_preview_path')
+		if(full_path == None or preview_path == None): continue
+		path = preview_path if use_previews else full_path
+		if(bpy.path.abspath(img.filepath) == path or not os.path.isfile(path)): continue
+		img.filepath = path
+		img.reload()
+		switched += 1
+	return switched
+
+def find_texture(uncook_path, tex_value, use_texture_index=False):
+	# Returns the absolute path of the .tga for an .xbm path from the XML, or None if it doesn't exist.
+	rel_path = tex_value.replace(".xbm", ".tga")
+	if(use_texture_index):
+		return get_texture_index(uncook_path).resolve(rel_path)
+	tex_path = uncook_path + os.sep + rel_path
+	if(os.path.isfile(tex_path)):
+		return tex_path
+	return None
+
+def texture_resolver(uncook_path, use_texture_index=False):
+	# Returns a function that finds the .tga of an .xbm value like find_texture(). It doesn't touch bpy, so it can be used by background threads.
+	if(use_texture_index):
+		index = get_texture_index(uncook_path)
+		return lambda tex_value: index.resolve(tex_value.replace(".xbm", ".tga"))
+	return lambda tex_value: find_texture(uncook_path, tex_value)
+
+def material_hash(mat_base, params):
+	# Canonical hash of a material's base shader and parameters, used as the key of the duplicate material index.
+	items = sorted( (str(k), str(v)) for k, v in params.items() )
+	key = str(mat_base) + "\n" + "\n".join(k + "=" + v for k, v in items)
+	return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+def material_params(mat_data):
 	params = {}
-	for p in mat_data:
-		params[p.get('name')] = p.get('value')
-		
-	# Setting blend mode
-	material.blend_method = 'CLIP'
-	
-	shader_type = mat_base.split("\\")[-1][:-5]	# The .w2mg or .w2mi file, minus the extension.
-	
-	nodes = material.node_tree.nodes
-	links = material.node_tree.links
-	
-	##########################
-	### Duplicate checking ###
-	##########################
-	
-	# Checking the custom properties that we created in previously imported materials
+	for p in mat_data.params:
+		params[p.name] = p.value
+	return params
+
+def read_materials_and_recipes(xml_path, resolve_texture=None):
+	# Reads the materials of an XML file and compiles the recipes of the ones that don't need anything from Blender.
+	# Returns the materials and a {material hash : recipe} dictionary. This runs on background threads, so the recipes are
+	# only added to recipe_cache by read_cached_xml(), on the main thread.
+	materials = read_materials(xml_path)
+	recipes = {}
+	if(resolve_texture == None):
+		return materials, recipes
+	for mat_data in materials:
+		# Material instances need the image nodes made by the FBX importer, see instance_texture_params().
+		if(mat_data.base == None or mat_data.base.endswith(".w2mi")): continue
+		mat_hash = material_hash(mat_data.base, material_params(mat_data))
+		if(mat_hash not in recipes):
+			recipes[mat_hash] = compile_recipe(mat_data.base, mat_data.params, resolve_texture)
+	return materials, recipes
+
+def build_material_index():
+	# Index every previously imported Witcher 3 material in the blend file by its material_hash().
+	global material_index
+	material_index = {}
 	for m in bpy.data.materials:
-		if(#'Material' not in m.name and	# To avoid matching any previous failed imports. TODO delete if this is no longer needed.
-		'witcher3_mat_params' in m and
-		mat_base == m['witcher3_mat_base'] and
-		params == m['witcher3_mat_params'].to_dict()):	# Comparing parameter dictionaries, this is the important part.
-			return m
-	
-	# Backing up all the info from the XML into custom properties. This is used for duplicate checking.
-	material['witcher3_mat_base'] = mat_base
-	material['witcher3_mat_params'] = params
+		if('witcher3_mat_params' not in m): continue
+		mat_hash = m.get('witcher3_mat_hash')
+		if(mat_hash == None):
+			# Materials imported before the index existed don't have the hash stored yet.
+			mat_hash = material_hash(m['witcher3_mat_base'], m['witcher3_mat_params'].to_dict())
+			m['witcher3_mat_hash'] = mat_hash
+		material_index[mat_hash] = m.name
+
+def find_indexed_material(mat_hash):
+	# Returns the existing material with this hash, or None.
+	if(material_index == None):
+		build_material_index()
 	
-	###################################
-	### Handling material instances ###
-	###################################
-	# The XML contains little to no info about these, but the FBX importer has imported some image nodes we can use.
-	if(mat_base.endswith(".w2mi")):
-		# Guesssing the shader type.
-		if('hair' in shader_type):
-			shader_type = 'pbr_hair'
-		elif('skin' in shader_type):
-			shader_type = 'pbr_skin'
-		elif('eye' in shader_type):
-			shader_type = 'pbr_eye'
-		else:
-			shader_type = 'pbr_std'
-		
-		# We will turn the nodes into params, so that the later code can process it like a normal material.
-		# It may seem weird that we're deleting some nodes only to re-make them later, but these nodes aren't set up the way I want them, so this seems the cleanest way to do it.
-		for n in material.node_tree.nodes:
-			if(n.type == 'TEX_IMAGE'):
-				# Since we want to compare this to what is in the .xml, we will replace the extension with .xbm.
-				image_filename = n.image.filepath.split("\\")[-1].split(".")[0]+".xbm"
+	mat_name = material_index.get(mat_hash)
+	if(mat_name == None):
+		return None
+	m = bpy.data.materials.get(mat_name)
+	if(m != None and m.get('witcher3_mat_hash') == mat_hash):
+		return m
+	
+	# The material was renamed or deleted since it was indexed, so the index is stale.
+	build_material_index()
+	mat_name = material_index.get(mat_hash)
+	if(mat_name == None):
+		return None
+	return bpy.data.materials.get(mat_name)
+
+def index_material(material):
+	if(material_index == None):
+		build_material_index()
+	material_index[material['witcher3_mat_hash']] = material.name
+
+def instance_texture_params(material, mat_data, shader_type, uncook_path):
+	# The XML contains little to no info about material instances, but the FBX importer has imported some image nodes we can use.
+	# Returns a W3Param for each of those images that isn't referenced by the XML, so they can be processed like a normal material.
+	new_params = []
+	for n in material.node_tree.nodes:
+		if(n.type == 'TEX_IMAGE'):
+			# Since we want to compare this to what is in the .xml, we will replace the extension with .xbm.
+			image_filename = n.image.filepath.split("\\")[-1].split(".")[0]+".xbm"
+			
+			# Check if this image is already a param
+			found = False
+			for param in mat_data.params:
+				type = param.type
+				value = param.value
+				if(type != 'handle:ITexture' or value=='NULL' ): continue
+				filename = value.split("\\")[-1]
+				if(filename == image_filename):
+					found = True
+					# If the image is already a param in the XML file, we don't need to worry about it.
+					break
+			
+			# If the image is not referenced by the XML file, it's time to turn the node into a param.
+			if(not found):
+				# Create a param and guessing the texture's type.
+				new_param = W3Param('Unknown', 'handle:ITexture', None)
+				new_params.append(new_param)
 				
-				# Check if this image is already a param
-				found = False
-				for param in mat_data:
-					type = param.get('type')
-					value = param.get('value')
-					if(type != 'handle:ITexture' or value=='NULL' ): continue
-					filename = value.split("\\")[-1]
-					if(filename == image_filename):
-						found = True
-						# If the image is already a param in the XML file, we don't need to worry about it.
-						break
+				# By the textures' naming conventions, there seem to be two places in the texture name that can tell us what type of texture it is:
+				# some_texture_d.xbm	"d" is the 5th character from the back
+				# some_texture_d01.xbm	"d" is the 7th character from the back
+				letter = n.image.filepath[-5]
 				
-				# If the image is not referenced by the XML file, it's time to turn the node into a param.
-				if(not found):
-					# Create a param and guessing the texture's type.
-					new_param = ET.SubElement(mat_data, 'param')
-					new_param.set('name', 'Unknown')
-					new_param.set('type', 'handle:ITexture')
-					
-					# By the textures' naming conventions, there seem to be two places in the texture name that can tell us what type of texture it is:
-					# some_texture_d.xbm	"d" is the 5th character from the back
-					# some_texture_d01.xbm	"d" is the 7th character from the back
-					letter = n.image.filepath[-5]
-					
-					if(letter in ['0', '1', '2', '3', '4', '5', '6', '7', '8', '9']):
-						letter = n.image.filepath[-7]
-					
-					if(letter == 'd'):
-						new_param.set('name', 'Diffuse')
-					elif(letter == 'n'):
-						new_param.set('name', 'Normal')
-					elif(letter == 's'):
-						new_param.set('name', 'SpecularTexture')
-					elif(letter == 'a'):
-						if(shader_type == 'pbr_skin'):
-							new_param.set('name', 'Ambient')
-						else:
-							new_param.set('name', 'TintMask')
+				if(letter in ['0', '1', '2', '3', '4', '5', '6', '7', '8', '9']):
+					letter = n.image.filepath[-7]
+				
+				if(letter == 'd'):
+					new_param.name = 'Diffuse'
+				elif(letter == 'n'):
+					new_param.name = 'Normal'
+				elif(letter == 's'):
+					new_param.name = 'SpecularTexture'
+				elif(letter == 'a'):
+					if(shader_type == 'pbr_skin'):
+						new_param.name = 'Ambient'
 					else:
-						print("Could not guess texture type: " + image_filename + " (THIS SHOULD NOT HAPPEN!)")
-					
-					# The 'value' needs to be the texture path relative to the uncook folder.
-					split_path = uncook_path.split("\\")
-					uncook_folder_name = split_path[-1].lower()
-					if(uncook_folder_name == ""):
-						uncook_folder_name = split_path[-2].lower()
-					rel_path = os.path.abspath(n.image.filepath).lower().split(uncook_folder_name)[-1]
-					new_param.set('value', rel_path)
-	
-	################################################
-	### Determine and create the right nodegroup ###
-	################################################
-	
-	# List of Witcher 3 shaders that will use Witcher3_Main nodegroup. (This is currently redundant since we will default to this anyways)
-	material_main = ['pbr_std',
-		'pbr_std_colorshift',
-		'pbr_std_tint_mask_2det',
-		'pbr_std_tint_mask_2det_fresnel',
-		'pbr_std_tint_mask_det',
-		'pbr_std_tint_mask_det_fresnel',
-		'pbr_std_tint_mask_det_pattern',
-		'pbr_spec_tint_mask_det',
-		'pbr_spec',
-		'transparent_lit',
-		'transparent_lit_vert',
-		'transparent_reflective',
-		'pbr_simple',
-		'pbr_simple_noemissive',
-		'pbr_det']
-	
-	# List of Witcher 3 shaders that will use Witcher3_Skin nodegroup.
-	material_skin = ['pbr_skin',
-		'pbr_skin_decal',
-		'pbr_skin_simple',
-		'pbr_skin_normalblend',
-		'pbr_skin_morph']
-	
-	# List of Witcher 3 shaders that will use Witcher3_Hair nodegroup.
-	material_hair = ['pbr_hair',
-		'pbr_hair_simple',
-		'pbr_hair_moving']
-	
-	# List of Witcher 3 shaders that will use Witcher3_Eye nodegroup.
-	material_eye = ['pbr_eye']
-	
-	ng = None		# Nodegroup node tree  (bpy.types.ShaderNodeTree)
-	node_ng = None	# Nodegroup group node (bpy.types.ShaderNodeGroup)
-	
-	if(shader_type in material_main):
-		ng = bpy.data.node_groups.get('Witcher3_Main')
-	elif(shader_type in material_skin):
-		ng = bpy.data.node_groups.get('Witcher3_Skin')
-	elif(shader_type in material_hair):
-		ng = bpy.data.node_groups.get('Witcher3_Hair')
-	elif(shader_type in material_eye):
-		ng = bpy.data.node_groups.get('Witcher3_Main')
-		#ng = bpy.data.node_groups.get('Witcher3_Eye')
-	else:
-		ng = bpy.data.node_groups.get('Witcher3_Main')
-	
-	if(ng != None):
-		# Wiping nodes created by fbx importer.
-		nodes.clear()
-		node_ng = nodes.new(type='ShaderNodeGroup')
-		node_ng.node_tree = ng
+						new_param.name = 'TintMask'
+				else:
+					print("Could not guess texture type: " + image_filename + " (THIS SHOULD NOT HAPPEN!)")
+				
+				# The 'value' needs to be the texture path relative to the uncook folder.
+				split_path = uncook_path.split("\\")
+				uncook_folder_name = split_path[-1].lower()
+				if(uncook_folder_name == ""):
+					uncook_folder_name = split_path[-2].lower()
+				rel_path = os.path.abspath(n.image.filepath).lower().split(uncook_folder_name)[-1]
+				new_param.value = rel_path
+	return new_params
+
+def load_recipe_texture(node, texture, lazy_textures=False):
+	# Sets up the image of an image node from a TextureSpec.
+	# The node may be a copy from a template material, so whatever the template's node had is replaced.
+	for prop in ['witcher3_tex_path', 'witcher3_non_color', 'witcher3_full_path']:
+		if(prop in node):
+			del node[prop]
+	if( texture.path == None ):
+		node.image = None
+		import_profiler.count('textures_missing')
+		print("Image not found: " + texture.value.replace(".xbm", ".tga"))
+		return
+	tex_path = texture.path
+	load_path = get_preview_path(tex_path)
+	if(lazy_textures):
+		# Only remembering the texture, it will be loaded by the Load Witcher 3 Textures operator.
+		node.image = get_placeholder_image(texture.normal_map)
+		node['witcher3_tex_path'] = load_path
+		node['witcher3_non_color'] = texture.non_color
+		if(load_path != tex_path):
+			node['witcher3_full_path'] = tex_path
+		import_profiler.count('textures_deferred')
 	else:
+		# Color space and alpha mode are set up by the pool, once per image.
+		with import_profiler.stage('texture_load'):
+			node.image = image_pool.get(load_path, texture.non_color)
+		if(load_path != tex_path):
+			node.image['witcher3_full_path'] = tex_path
+			node.image['witcher3_preview_path'] = load_path
+	image_pool.add_user(load_path)
+
+def get_socket(sockets, key):
+	# Sockets are referred to by index, or by name when they might not exist.
+	if(type(key) == str):
+		return sockets.get(key)
+	return sockets[key]
+
+def set_recipe_values(nodes, recipe, lazy_textures=False):
+	# Sets the labels, property and socket values and images of a list of nodes matching recipe.nodes.
+	for node, spec in zip(nodes, recipe.nodes):
+		node.label = spec.label
+		for attr, value in spec.props:
+			setattr(node, attr, value)
+		for i, value in spec.inputs:
+			node.inputs[i].default_value = value
+		for i, value in spec.outputs:
+			node.outputs[i].default_value = value
+		if(spec.texture != None):
+			load_recipe_texture(node, spec.texture, lazy_textures)
+
+def instantiate_recipe(material, recipe, lazy_textures=False):
+	# Replaces the nodes of a material with the ones described by a MaterialRecipe. Returns the new nodes, in the order of recipe.nodes.
+	ng = bpy.data.node_groups.get(recipe.group)
+	if(ng == None):
 		raise W3ImporterError('Error loading material: Missing Witcher 3 Nodegroups')
 	
-	node_ng.location = (500, 200)
-	node_ng.width = 350
+	nodes = material.node_tree.nodes
+	links = material.node_tree.links
+	# Wiping nodes created by fbx importer.
+	nodes.clear()
+	
+	created = []
+	for spec in recipe.nodes:
+		node = nodes.new(type=spec.kind)
+		if(spec.name != None):
+			node.name = spec.name
+		node.location = spec.location
+		if(spec.width != None):
+			node.width = spec.width
+		node.hide = spec.hide
+		if(spec.group != None):
+			node.node_tree = bpy.data.node_groups[spec.group]
+		created.append(node)
+	set_recipe_values(created, recipe, lazy_textures)
+	
+	for l in recipe.links:
+		to_socket = get_socket(created[l.to_node].inputs, l.to_socket)
+		if(to_socket == None or (l.only_if_free and len(to_socket.links) > 0)): continue
+		links.new(get_socket(created[l.from_node].outputs, l.from_socket), to_socket)
+	
+	# Checking if nodes got connected and printing to console if not.
+	for i in recipe.param_nodes:
+		if(len(created[i].outputs[0].links)==0):
+			print("Unconnected node: " + created[i].name)
+	
+	return created
+
+def template_nodes(material, recipe, node_names):
+	# Returns the nodes of a material by their names, in the order of recipe.nodes, or None if they don't match the recipe (the material was edited).
+	nodes = []
+	for spec, name in zip(recipe.nodes, node_names):
+		node = material.node_tree.nodes.get(name)
+		if(node == None or node.bl_idname != spec.kind):
+			return None
+		if(spec.name != None and spec.name != recipe.base and node.name != spec.name):
+			return None
+		if(spec.group != None and (node.node_tree == None or node.node_tree.name != spec.group)):
+			return None
+		nodes.append(node)
+	return nodes
+
+def copy_material_template(recipe, signature, lazy_textures=False):
+	# Returns a copy of an earlier material of this session that has the same node structure as the recipe, with the recipe's values set,
+	# and its nodes in the order of recipe.nodes. Returns None, None if there is no such material.
+	template_name, node_names = material_templates.get(signature, ("", []))
+	template = bpy.data.materials.get(template_name)
+	if(template == None or template.get('witcher3_recipe_signature') != signature or template.node_tree == None
+		or len(node_names) != len(recipe.nodes) or len(template.node_tree.nodes) != len(recipe.nodes)
+		or template_nodes(template, recipe, node_names) == None):
+		# The template was removed or edited.
+		material_templates.pop(signature, None)
+		return None, None
+	
+	material = template.copy()
+	# Copies keep the node names.
+	nodes = template_nodes(material, recipe, node_names)
+	for node, spec in zip(nodes, recipe.nodes):
+		if(spec.name == recipe.base):
+			node.name = spec.name
+	set_recipe_values(nodes, recipe, lazy_textures)
+	return material, nodes
+
+def setup_w3_material(material, mat_data, obj, uncook_path=None, use_texture_index=False, lazy_textures=False, use_templates=True):
+	# Checks for duplicate materials
+	# Compiles the material recipe, unless it was compiled in the background
+	# Creates nodes and loads images from the recipe, or copies a material with the same nodes and only sets the values (use_templates)
+	# Saves XML data in custom properties
+	# Returns the material to use, which is not the passed material when a duplicate or a template was found.
+	if(uncook_path == None):
+		addon_prefs = get_addon_prefs()
+		if(addon_prefs == None):
+			raise W3ImporterError("No uncook path was given and the add-on preferences are not available.")
+		uncook_path = addon_prefs.uncook_path
+		use_texture_index = addon_prefs.use_texture_index
 	
-	#############################
-	### Creating output nodeS ###
-	#############################
+	mat_base = mat_data.base		# Path to the .w2mg or .w2mi file.
+	params = material_params(mat_data)
 	
-	node_output_cycles = nodes.new(type='ShaderNodeOutputMaterial')
-	node_output_cycles.target = 'CYCLES'
-	node_output_cycles.location = (900, 200)
-	node_output_cycles.name = mat_base
-	node_output_cycles.label = shader_type
-	links.new(node_ng.outputs[0], node_output_cycles.inputs[0])
+	##########################
+	### Duplicate checking ###
+	##########################
 	
-	node_output_eevee = nodes.new(type='ShaderNodeOutputMaterial')
-	node_output_eevee.target = 'EEVEE'
-	node_output_eevee.location = (900, 0)
-	node_output_eevee.name = mat_base
-	node_output_eevee.label = shader_type
-	links.new(node_ng.outputs[1], node_output_eevee.inputs[0])
+	# Looking up previously imported materials by the hash of their base and parameters.
+	mat_hash = material_hash(mat_base, params)
+	existing = find_indexed_material(mat_hash)
+	if(existing != None and existing != material):
+		import_profiler.count('materials_reused')
+		return existing
+	import_profiler.count('materials')
+	
+	########################
+	### Compiling recipe ###
+	########################
+	
+	recipe = recipe_cache.get(mat_hash)
+	if(recipe == None):
+		with import_profiler.stage('material_compile'):
+			mat_params = mat_data.params
+			if(mat_base.endswith(".w2mi")):
+				mat_params = mat_params + instance_texture_params(material, mat_data, shader_type_of(mat_base), uncook_path)
+			recipe = compile_recipe(mat_base, mat_params, texture_resolver(uncook_path, use_texture_index))
+		recipe_cache[mat_hash] = recipe
 	
 	######################
-	### Sorting params ###
+	### Building nodes ###
 	######################
 	
-	equivalent_params = {	# TODO: I should probably go about this in a better way. It should probably be a Pin:[Equivalents] dict, not an equivalent:pin dict.
-		'Diffusemap' : 'Diffuse',
-		'Normalmap' : 'Normal',
-		'Ambientmap' : 'TintMask'
-		}
-	
-	ignored_params = ['DetailRange',
-	'Pattern_Array', 'Pattern_Mixer', 'Pattern_Index', 'Pattern_Offset', 'Pattern_Size', 'Pattern_DistortionPower', 'Pattern_Rotation', 'handle:CTextureArray', 'Pattern_Roughness_Influence', 'Pattern_Color1', 'Pattern_Color2', 'Pattern_Color3']	# These Pattern textures are hidden in a .texarr file so we can't get any use out of them.
-	
-	# Ordering the parameters so that the input nodes get created in this order, from top to bottom. Purely for neatness.
-	order = ['Diffuse', 'Normal', 'Ambient', 'TintMask', 'SpecularTexture', 'SpecularColor', 
-		'RSpecScale', 'RSpecBase', 
-		'Anisotropy', 'SpecularShiftTexture', 'SpecularShiftUVScale', 'SpecularShiftScale', 
-		'Translucency', 'TranslucencyRim', 'TranslucencyRimScale', 
-		'FresnelStrength', 'FresnelPower', 
-		'AOPower', 'AmbientPower', 
-		'DetailPower', 
-		'DetailNormal', 'DetailTile', 'DetailRange', 'DetailRotation', 
-		'DetailNormal1', 'DetailTile1', 'DetailRange1', 'DetailRotation1', 
-		'Detail1Normal', 'Detail1Tile', 'Detail1Range', 'Detail1Rotation', 
-		'Detail2Normal', 'Detail2Tile', 'Detail2Range', 'Detail2Rotation', 
-		'DetailNormal2', 'DetailTile2', 'DetailRange2', 'DetailRotation2', 
-		]
-	
-	ordered_params = order_elements_by_attribute(mat_data, order, 'name')
-	
-	#################################
-	### Loading params into nodes ###
-	#################################
-	
-	y_loc = 1000	# Y location of the next node to spawn.
-	for param in ordered_params:
-		par_name = param.get('name')
-		par_type = param.get('type')
-		par_value = param.get('value')
-		
-		if(par_value == 'NULL' or 
-			par_name in ignored_params):
-			continue
-		
-		node_label = par_name
-		y_loc_increment = -170
-		node=None
-		
-		### Texture inputs  ###
-		if(par_type=='handle:ITexture'):
-			node = nodes.new(type="ShaderNodeTexImage")
-			node.width = 300
-			
-			# Setting Color/Non-Color Data
-			if(par_name not in ['Diffuse', 'SpecularTexture', 'TintMask']):
-				if(node.image):
-					node.image.colorspace_settings.name = 'Non-Color'
-			
-			### Some texture types need special treatment ###
-			if(par_name == 'Normal'):
-				roughness_pin = node_ng.inputs.get('Roughness')
-				if(roughness_pin != None):
-					links.new(node.outputs[1], roughness_pin)
-			elif(par_name == 'Diffuse'):
-				alpha_pin = node_ng.inputs.get('Alpha')
-				if(alpha_pin != None):
-					links.new(node.outputs[1], alpha_pin)
-			elif( (('Normal' in par_name) and ('Detail' in par_name)) or
-			'SpecularShiftTexture' == par_name):
-				# DetailNormals need a Mapping node to apply the DetailScale and DetailRotation to.
-				node_mapping = nodes.new(type='ShaderNodeMapping')
-				node_mapping.location = (-600, y_loc-200)
-				node_mapping.hide = True
-				links.new(node_mapping.outputs[0], node.inputs[0])
-				
-				node_uv = nodes.new(type='ShaderNodeUVMap')
-				node_uv.location = (node_mapping.location.x-200, node_mapping.location.y)
-				node_uv.hide = True
-				links.new(node_uv.outputs[0], node_mapping.inputs[0])
-			
-			#######################
-			### Loading texture ###
-			#######################
-			tex_path = uncook_path + os.sep + par_value.replace(".xbm", ".tga")
-			if( not os.path.isfile(tex_path) ):
-				print("Image not found: " + tex_path)
-				node_label = "MISSING:" + par_value
-			else:
-				img = node.image = bpy.data.images.load(tex_path, check_existing=True)
-				# Moving images to local textures folder
-				# TODO: why are we still referring to node.image instead of img?
-				if(bpy.data.is_saved and len(node.image.packed_files) > 0):
-					img.pack()
-					node.image.unpack(method='WRITE_LOCAL')
-				node.image.name = node.image.filepath.split("\\")[-1].split(".")[0]	# Yikes.
-				# Setting color space and alpha mode (TODO: check that this works) (Other TODO: fix this when it gets broken by https://developer.blender.org/T60990)
-				if(node.image):
-					if( node.image.colorspace_settings.name == 'Non-Color' ):
-						img.alpha_mode = 'CHANNEL_PACKED'
-					else:
-						img.alpha_mode = 'STRAIGHT'
-					
-			y_loc_increment = -320
-			
-		### Float inputs ###
-		elif(par_type=='Float'):
-			if('Rotation' in par_name):
-				normal_node = nodes.get(par_name.replace('Rotation', 'Normal'))
-				if(normal_node != None):
-					mapping_node = normal_node.inputs[0].links[0].from_node
-					mapping_node.rotation[2] = float(par_value)
-					continue
-			node = nodes.new(type='ShaderNodeValue')
-			node.outputs[0].default_value = float(par_value)
-			
-		### Color inputs ###
-		elif(par_type=='Color'):
-			values = [float(f) for f in par_value.split("; ")]
-			if(values[3] == 255):	# If the Alpha value is 1, use the better looking CombineRGB node. (Discarding the useless alpha)
-				node = nodes.new(type='ShaderNodeCombineRGB')
-				node.inputs[0].default_value = values[0]/255
-				node.inputs[1].default_value = values[1]/255
-				node.inputs[2].default_value = values[2]/255
-				#map(lambda x: node.inputs[x].default_value = values[x]/255, range(3))
-			else:					# Otherwise, use the uglier RGB node which supports Alpha.
-				node = nodes.new(type='ShaderNodeRGB')
-				node.outputs[0].default_value = (values[0]/255, values[1]/255, values[2]/255, values[3]/255)
-		
-		### Vector inputs ###
-		elif(par_type=='Vector'):
-			values = [float(f) for f in par_value.split("; ")]
-			# Handling UV scale nodes for detail normals and SpecularShiftTextures
-			if( ('Tile' in par_name) or ('SpecularShiftUVScale' in par_name) ):
-				target_node = nodes.get(par_name.replace('Tile', 'Normal'))
-				if(target_node == None): 
-					target_node = nodes.get('SpecularShiftTexture')
-				if(target_node != None):
-					mapping_node = target_node.inputs[0].links[0].from_node
-					mapping_node.scale[0] = values[0]
-					mapping_node.scale[1] = values[1]
-					continue
-			if(values[3] != 1 and values[3] != 0):	# The 4th value on vectors is probably always useless, but just in case.
-				print("Warning: Discarded vector 4th value: " + str(values) + " in parameter: " + par_name)
-			node = nodes.new(type='ShaderNodeCombineXYZ')
-			#map(lambda x: node.inputs[x].default_value = values[x], range(3))
-			node.inputs[0].default_value = values[0]
-			node.inputs[1].default_value = values[1]
-			node.inputs[2].default_value = values[2]
-		
-		# Unknown inputs are created as an Attribute node.
-		else:
-			print("Unknown material parameter type: "+par_type)
-			node = nodes.new(type="ShaderNodeAttribute")
-			node_label = "Unknown type: " + par_type
-			node.attribute_name = par_value
-		
-		node.location = (-450, y_loc)
-		node.name = par_name
-		node.label = node_label
-		y_loc = y_loc + y_loc_increment
-		
-		# Linking the node to the nodegroup
-		if( node.label in equivalent_params ):
-			input_pin = node_ng.inputs.get(equivalent_params[node.label])
-			if(input_pin != None and len(input_pin.links) == 0):
-				links.new(node.outputs[0], input_pin)
-		input_pin = node_ng.inputs.get(node.label)
-		if(input_pin != None):
-			links.new(node.outputs[0], input_pin)
-		
-		# Checking if node got connected and printing to console if not.
-		if(len(node.outputs[0].links)==0):
-			print("Unconnected node: " + node.name)
+	signature = recipe_signature(recipe)
+	copy = nodes = None
+	if(use_templates):
+		copy, nodes = copy_material_template(recipe, signature, lazy_textures)
+	if(copy != None):
+		import_profiler.count('materials_templated')
+		# Named like the material it replaces, in case it isn't named after its diffuse texture below.
+		copy.name = material.name
+		material = copy
+	else:
+		nodes = instantiate_recipe(material, recipe, lazy_textures)
+	node_ng = nodes[0]
+	
+	# Setting blend mode
+	material.blend_method = 'CLIP'
+	
+	# Backing up all the info from the XML into custom properties. This is used for duplicate checking.
+	material['witcher3_mat_base'] = mat_base
+	material['witcher3_mat_params'] = params
+	material['witcher3_mat_hash'] = mat_hash
+	material['witcher3_recipe_signature'] = signature
 	
 	if( len(node_ng.inputs[0].links) > 0 ):
 		color_node = node_ng.inputs[0].links[0].from_node
-		nodes.active = color_node
-		if(color_node.image != None):
+		material.node_tree.nodes.active = color_node
+		if(color_node.get('witcher3_tex_path') != None):
+			image_name = os.path.splitext(os.path.basename(color_node['witcher3_tex_path']))[0]
+			material.name = image_name.split("_d0")[0].split("_d.")[0]
+		elif(color_node.image != None):
 			material.name = color_node.image.name.split("_d0")[0].split("_d.")[0]
 		else:
 			print("Warning: No diffuse texture found for material: " + material.name)
@@ -452,278 +696,361 @@ def setup_w3_material(material, mat_data, obj):
 	material.roughness = 0.5
 	material.diffuse_color = (0.3, 0.3, 0.3, 1)
 	
+	# Indexing under the final name, since the material may have been renamed above.
+	index_material(material)
+	if(use_templates and copy == None):
+		material_templates[signature] = (material.name, [node.name for node in nodes])
+	
 	return material
 
-def load_w3_materials(obj, xml_path):	
+# Material names given by the FBX importer, "Material12", possibly with a suffix added by Blender, "Material12.001".
+fbx_material_re = re.compile(r"Material(\d+)(?:\.\d+)?$")
+# Number at the end of an XML material name.
+xml_material_re = re.compile(r"(\d+)$")
+
+def material_slot_index(obj):
+	# Returns a dictionary of the FBX material number : material slot index of an object.
+	index = {}
+	for i, slot in enumerate(obj.material_slots):
+		if(slot.material == None): continue
+		match = fbx_material_re.search(slot.material.name)
+		if(match != None):
+			index.setdefault(int(match.group(1)), i)
+	return index
+
+def load_w3_materials(obj, xml_path, uncook_path=None, use_texture_index=False, lazy_textures=False, use_templates=True):	
 	# Reads XML and sets up all materials on the object.
 	# It unavoidably requires that materials were not yet renamed after the FBX import.
-	root = readXML(xml_path)
-	
-	for rootelement in root:
-		if(rootelement.tag=='materials'):
-			for mat_data in rootelement:
-				mat_name = mat_data.get('name')
-				# Finding corresponding blender material
-				target_mat = None
-				for m in obj.data.materials:
-					# Comparing the number at the end of the blender material name "MaterialX" to the last character of the XML material.
-					if("Material" in m.name and 
-						m.name[8] == mat_name[-1]):
-						target_mat = m
-						break
-				if(target_mat == None):	
-					# If we didn't find a matching blender material, it's a material for the LOD meshes, ignore it.
-					continue
-				
-				finished_mat = setup_w3_material(target_mat, mat_data, obj)
-				obj.material_slots[target_mat.name].material = finished_mat
+	slot_index = material_slot_index(obj)
+	unmatched = []
+	for mat_data in read_cached_xml(xml_path):
+		# Finding the corresponding blender material by the number at the end of its name.
+		match = xml_material_re.search(mat_data.name or "")
+		slot = slot_index.get(int(match.group(1))) if match != None else None
+		if(slot == None):
+			# If we didn't find a matching blender material, it's a material for the LOD meshes, ignore it.
+			unmatched.append(str(mat_data.name))
+			continue
+		
+		target_mat = obj.material_slots[slot].material
+		finished_mat = setup_w3_material(target_mat, mat_data, obj, uncook_path, use_texture_index, lazy_textures, use_templates)
+		obj.material_slots[slot].material = finished_mat
+	
+	if(len(unmatched) > 0):
+		import_profiler.count('materials_unmatched', len(unmatched))
+		print("%d XML materials have no material slot on %s (LOD materials?): %s" %(len(unmatched), obj.name, ", ".join(unmatched)))
+
+# Child:parent bone name dictionary of the Witcher 3 skeletons.
+W3_BONE_PARENTS = {
+	# spine
+	'pelvis': 'torso',
+	'torso2': 'torso',
+	'torso3': 'torso2',
+	'neck': 'torso3',
+	'head': 'neck',
+	
+	# breasts
+	'l_boob': 'torso3',
+	'r_boob': 'torso3',
+	
+	#right leg
+	'r_thigh': 'pelvis',
+	'r_legRoll': 'torso',
+	'r_legRoll2': 'torso',
+	'r_shin': 'r_thigh',
+	'r_kneeRoll': 'r_shin',
+	'r_foot': 'r_shin',
+	'r_toe': 'r_foot',
+	
+	#right arm
+	'r_shoulder': 'torso3',
+	'r_shoulderRoll': 'r_shoulder',
+	'r_bicep': 'r_shoulder',
+	'r_bicep2': 'r_bicep',
+	'r_elbowRoll': 'r_bicep',
+	'r_forearmRoll1': 'r_elbowRoll',
+	'r_forearmRoll2': 'r_elbowRoll',
+	'r_handRoll': 'r_elbowRoll',
+	
+	#right hand
+	'r_hand': 'r_elbowRoll',
+	'r_pinky0': 'r_hand',
+	
+	'r_thumb1': 'r_hand',
+	'r_thumb_roll': 'r_hand',
+	'r_thumb2': 'r_thumb1',
+	'r_thumb3': 'r_thumb2',
+	
+	'r_index_knuckleRoll': 'r_hand',
+	'r_index1': 'r_hand',
+	'r_index2': 'r_index1',
+	'r_index3': 'r_index2',
+	
+	'r_middle_knuckleRoll': 'r_hand',
+	'r_middle1': 'r_hand',
+	'r_middle2': 'r_middle1',
+	'r_middle3': 'r_middle2',
+	
+	'r_ring_knuckleRoll': 'r_hand',
+	'r_ring1': 'r_hand',
+	'r_ring2': 'r_ring1',
+	'r_ring3': 'r_ring2',
+	
+	'r_pinky_knuckleRoll': 'r_hand',
+	'r_pinky1': 'r_pinky0',
+	'r_pinky2': 'r_pinky1',
+	'r_pinky3': 'r_pinky2',
+	
+	#left leg
+	'l_thigh': 'pelvis',
+	'l_legRoll': 'torso',
+	'l_legRoll2': 'torso',
+	'l_shin': 'l_thigh',
+	'l_kneeRoll': 'l_shin',
+	'l_foot': 'l_shin',
+	'l_toe': 'l_foot',
+	
+	#left arm
+	'l_shoulder': 'torso3',
+	'l_shoulderRoll': 'l_shoulder',
+	'l_bicep': 'l_shoulder',
+	'l_bicep2': 'l_bicep',
+	'l_elbowRoll': 'l_bicep',
+	'l_forearmRoll1': 'l_elbowRoll',
+	'l_forearmRoll2': 'l_elbowRoll',
+	'l_handRoll': 'l_elbowRoll',
+	
+	#left hand
+	'l_hand': 'l_elbowRoll',
+	'l_pinky0': 'l_hand',
+	
+	'l_thumb1': 'l_hand',
+	'l_thumb_roll': 'l_hand',
+	'l_thumb2': 'l_thumb1',
+	'l_thumb3': 'l_thumb2',
+	
+	'l_index_knuckleRoll': 'l_hand',
+	'l_index1': 'l_hand',
+	'l_index2': 'l_index1',
+	'l_index3': 'l_index2',
+	
+	'l_middle_knuckleRoll': 'l_hand',
+	'l_middle1': 'l_hand',
+	'l_middle2': 'l_middle1',
+	'l_middle3': 'l_middle2',
+	
+	'l_ring_knuckleRoll': 'l_hand',
+	'l_ring1': 'l_hand',
+	'l_ring2': 'l_ring1',
+	'l_ring3': 'l_ring2',
+	
+	'l_pinky_knuckleRoll': 'l_hand',
+	'l_pinky1': 'l_pinky0',
+	'l_pinky2': 'l_pinky1',
+	'l_pinky3': 'l_pinky2',
+	
+	#head / face
+	'thyroid': 'head',
+	'hroll': 'head',
+	'jaw': 'head',
+	'ears': 'head',
+	'nose': 'head',
+	'nose_base': 'head',
+	'lowwer_lip': 'jaw',
+	'upper_lip': 'head',
+	'chin': 'jaw',
+	
+	'right_temple': 'head',
+	'right_forehead': 'head',
+	'right_chick1': 'head',
+	'right_chick2': 'head',
+	'right_chick3': 'head',
+	'right_chick4': 'head',
+	'right_nose1': 'head',
+	'right_nose2': 'head',
+	'right_nose3': 'head',
+	'right_eyebrow1': 'head',
+	'right_eyebrow2': 'head',
+	'right_eyebrow3': 'head',
+	'right_eye': 'head',
+	
+	'upper_right_eyelid1': 'head',
+	'upper_right_eyelid2': 'head',
+	'upper_right_eyelid3': 'head',
+	'upper_right_eyelid_fold': 'head',
+	'lowwer_right_eyelid1': 'head',
+	'lowwer_right_eyelid2': 'head',
+	'lowwer_right_eyelid3': 'head',
+	'lowwer_right_eyelid_fold': 'head',
+	
+	'tongue_left_side' : 'tongue2',
+	'tongue_right_side' : 'tongue2',
+	'tongue1' : 'jaw',
+	
+	'right_mouth_fold1': 'jaw',
+	'right_mouth2': 'jaw',
+	'right_mouth1': 'jaw',
+	'upper_right_lip': 'head',
+	'lowwer_right_lip': 'jaw',
+	'right_corner_lip2': 'jaw',
+	'right_corner_lip1': 'head',
+	'right_mouth3': 'head',
+	'right_mouth4': 'head',
+	'right_mouth_fold2': 'head',
+	'right_mouth_fold3': 'head',
+	'right_mouth_fold4': 'head',
+	
+	'left_temple': 'head',
+	'left_forehead': 'head',
+	'left_chick1': 'head',
+	'left_chick2': 'head',
+	'left_chick3': 'head',
+	'left_chick4': 'head',
+	'left_nose1': 'head',
+	'left_nose2': 'head',
+	'left_nose3': 'head',
+	'left_eyebrow1': 'head',
+	'left_eyebrow2': 'head',
+	'left_eyebrow3': 'head',
+	'left_eye': 'head',
+	
+	'upper_left_eyelid1': 'head',
+	'upper_left_eyelid2': 'head',
+	'upper_left_eyelid3': 'head',
+	'upper_left_eyelid_fold': 'head',
+	'lowwer_left_eyelid1': 'head',
+	'lowwer_left_eyelid2': 'head',
+	'lowwer_left_eyelid3': 'head',
+	'lowwer_left_eyelid_fold': 'head',
+
+	'upper_left_eyelash' : 'upper_left_eyelid2',  
+	'upper_right_eyelash' : 'upper_right_eyelid2',  
+	
+	'left_mouth_fold1': 'jaw',
+	'left_mouth2': 'jaw',
+	'left_mouth1': 'jaw',
+	'upper_left_lip': 'head',
+	'lowwer_left_lip': 'jaw',
+	'left_corner_lip2': 'jaw',
+	'left_corner_lip1': 'head',
+	'left_mouth3': 'head',
+	'left_mouth4': 'head',
+	'left_mouth_fold2': 'head',
+	'left_mouth_fold3': 'head',
+	'left_mouth_fold4': 'head',
+	
+	#util
+	'dyng_frontbag_01': 'torso',
+	'dyng_backbag_01' : 'pelvis',
+	'hinge_frontrag' : 'pelvis',
+	'dyng_back_belt_01' : 'torso2',
+	'dyng_front_belt_01' : 'torso2',
+	
+	#succubus
+	'dyng_tail_01': 'torso',
+	
+	# weapons
+	'steel_sword_scabbard_3' : 'steel_sword_scabbard_2',
+	'steel_sword_scabbard_2' : 'steel_sword_scabbard_1',
+	'steel_sword_scabbard_1' : 'torso3',
+	
+	'dyng_dagger_01' : 'pelvis',
+	
+	# medallions, necklaces
+	'dyng_pendant_01' : 'head',
+	'dyng_necklace_01' : 'torso3',
+	
+	'medalion_main_01' : 'r_medalion_03',
+	'r_medalion_03' : 'r_medalion_02',
+	'r_medalion_02' : 'torso3',
+	'l_medalion_03' : 'l_medalion_02',
+	'l_medalion_02' : 'torso3',
+	
+	'vesemir_medalion_main_01' : 'r_vesemir_medalion_02',
+	'r_vesemir_medalion_01' : 'torso3',
+	'l_vesemir_medalion_01' : 'torso3',
+	
+	'dyng_r_necklace_01' : 'torso3',
+	'dyng_l_necklace_01' : 'torso3',
+	'dyng_m_necklace_01' : 'dyng_l_necklace_02',
+	
+	# random clothes
+	'dyng_l_double_earing_01' : 'head',
+	'dyng_r_double_earing_01' : 'head',
+	
+	'hinge_l_collar' : 'torso3',
+	'hinge_r_collar' : 'torso3'
+}
+
+def bone_parent_chain(bone_name):
+	# Ancestors of a bone according to W3_BONE_PARENTS, nearest first.
+	chain = []
+	parent_name = W3_BONE_PARENTS.get(bone_name)
+	while(parent_name != None):
+		chain.append(parent_name)
+		parent_name = W3_BONE_PARENTS.get(parent_name)
+	return tuple(chain)
+
+# Ancestor chains of all bones in W3_BONE_PARENTS, so finding the nearest existing parent doesn't need to walk the dictionary.
+W3_BONE_PARENT_CHAINS = {name : bone_parent_chain(name) for name in W3_BONE_PARENTS}
+
+numbered_bone_re = re.compile(r"^(.*?)(\d+)$")
+
+def numbered_bone_parents(bone_name):
+	# Bones ending in a number are parented to the bone with the same name but lower number.
+	# Returns the candidate parent names, since the number may or may not be zero-padded. (hair_10 -> hair_09 or hair_9)
+	match = numbered_bone_re.match(bone_name)
+	if(match == None):
+		return ()
+	prefix, digits = match.groups()
+	number = int(digits)
+	if(number == 1 and 'hair' in bone_name):
+		# This lets us avoid having to put every hair1 bone in the dict.
+		return ('head',)
+	if(number == 0):
+		return ()
+	lower = str(number-1)
+	candidates = [prefix + lower.zfill(len(digits))]
+	if(len(lower) < len(digits) and not digits.startswith('0')):
+		candidates.append(prefix + lower)
+	return tuple(candidates)
+
+def find_nearest_parents(edit_bones):
+	# Returns a dictionary of bone name : name of the nearest existing parent bone, even if the direct parent bone is missing.
+	# Bones for which no parent was found are left out.
+	existing = set(eb.name for eb in edit_bones)
+	numbered_parents = {}	# Memo of numbered_bone_parents() lookups in this armature.
+	
+	def nearest_numbered_parent(bone_name):
+		if(bone_name not in numbered_parents):
+			numbered_parents[bone_name] = None
+			for candidate in numbered_bone_parents(bone_name):
+				if(candidate in existing):
+					numbered_parents[bone_name] = candidate
+					break
+		return numbered_parents[bone_name]
+	
+	parents = {}
+	for bone_name in existing:
+		parent_name = None
+		chain = W3_BONE_PARENT_CHAINS.get(bone_name)
+		if(chain == None):
+			# Not in the dictionary.
+			parent_name = nearest_numbered_parent(bone_name)
+		else:
+			for ancestor in chain:
+				if(ancestor in existing):
+					parent_name = ancestor
+					break
+			else:
+				# None of the dictionary ancestors exist, the last one may still be a numbered bone.
+				parent_name = nearest_numbered_parent(chain[-1])
+		if(parent_name != None and parent_name != bone_name):
+			parents[bone_name] = parent_name
+	return parents
 
 def parent_w3_bones(armature):	
-	# Parent bones using a child:parent name dictionary. 
-	parent_dict = {
-		# spine
-		'pelvis': 'torso',
-		'torso2': 'torso',
-		'torso3': 'torso2',
-		'neck': 'torso3',
-		'head': 'neck',
-		
-		# breasts
-		'l_boob': 'torso3',
-		'r_boob': 'torso3',
-		
-		#right leg
-		'r_thigh': 'pelvis',
-		'r_legRoll': 'torso',
-		'r_legRoll2': 'torso',
-		'r_shin': 'r_thigh',
-		'r_kneeRoll': 'r_shin',
-		'r_foot': 'r_shin',
-		'r_toe': 'r_foot',
-		
-		#right arm
-		'r_shoulder': 'torso3',
-		'r_shoulderRoll': 'r_shoulder',
-		'r_bicep': 'r_shoulder',
-		'r_bicep2': 'r_bicep',
-		'r_elbowRoll': 'r_bicep',
-		'r_forearmRoll1': 'r_elbowRoll',
-		'r_forearmRoll2': 'r_elbowRoll',
-		'r_handRoll': 'r_elbowRoll',
-		
-		#right hand
-		'r_hand': 'r_elbowRoll',
-		'r_pinky0': 'r_hand',
-		
-		'r_thumb1': 'r_hand',
-		'r_thumb_roll': 'r_hand',
-		'r_thumb2': 'r_thumb1',
-		'r_thumb3': 'r_thumb2',
-		
-		'r_index_knuckleRoll': 'r_hand',
-		'r_index1': 'r_hand',
-		'r_index2': 'r_index1',
-		'r_index3': 'r_index2',
-		
-		'r_middle_knuckleRoll': 'r_hand',
-		'r_middle1': 'r_hand',
-		'r_middle2': 'r_middle1',
-		'r_middle3': 'r_middle2',
-		
-		'r_ring_knuckleRoll': 'r_hand',
-		'r_ring1': 'r_hand',
-		'r_ring2': 'r_ring1',
-		'r_ring3': 'r_ring2',
-		
-		'r_pinky_knuckleRoll': 'r_hand',
-		'r_pinky1': 'r_pinky0',
-		'r_pinky2': 'r_pinky1',
-		'r_pinky3': 'r_pinky2',
-		
-		#left leg
-		'l_thigh': 'pelvis',
-		'l_legRoll': 'torso',
-		'l_legRoll2': 'torso',
-		'l_shin': 'l_thigh',
-		'l_kneeRoll': 'l_shin',
-		'l_foot': 'l_shin',
-		'l_toe': 'l_foot',
-		
-		#left arm
-		'l_shoulder': 'torso3',
-		'l_shoulderRoll': 'l_shoulder',
-		'l_bicep': 'l_shoulder',
-		'l_bicep2': 'l_bicep',
-		'l_elbowRoll': 'l_bicep',
-		'l_forearmRoll1': 'l_elbowRoll',
-		'l_forearmRoll2': 'l_elbowRoll',
-		'l_handRoll': 'l_elbowRoll',
-		
-		#left hand
-		'l_hand': 'l_elbowRoll',
-		'l_pinky0': 'l_hand',
-		
-		'l_thumb1': 'l_hand',
-		'l_thumb_roll': 'l_hand',
-		'l_thumb2': 'l_thumb1',
-		'l_thumb3': 'l_thumb2',
-		
-		'l_index_knuckleRoll': 'l_hand',
-		'l_index1': 'l_hand',
-		'l_index2': 'l_index1',
-		'l_index3': 'l_index2',
-		
-		'l_middle_knuckleRoll': 'l_hand',
-		'l_middle1': 'l_hand',
-		'l_middle2': 'l_middle1',
-		'l_middle3': 'l_middle2',
-		
-		'l_ring_knuckleRoll': 'l_hand',
-		'l_ring1': 'l_hand',
-		'l_ring2': 'l_ring1',
-		'l_ring3': 'l_ring2',
-		
-		'l_pinky_knuckleRoll': 'l_hand',
-		'l_pinky1': 'l_pinky0',
-		'l_pinky2': 'l_pinky1',
-		'l_pinky3': 'l_pinky2',
-		
-		#head / face
-		'thyroid': 'head',
-		'hroll': 'head',
-		'jaw': 'head',
-		'ears': 'head',
-		'nose': 'head',
-		'nose_base': 'head',
-		'lowwer_lip': 'jaw',
-		'upper_lip': 'head',
-		'chin': 'jaw',
-		
-		'right_temple': 'head',
-		'right_forehead': 'head',
-		'right_chick1': 'head',
-		'right_chick2': 'head',
-		'right_chick3': 'head',
-		'right_chick4': 'head',
-		'right_nose1': 'head',
-		'right_nose2': 'head',
-		'right_nose3': 'head',
-		'right_eyebrow1': 'head',
-		'right_eyebrow2': 'head',
-		'right_eyebrow3': 'head',
-		'right_eye': 'head',
-		
-		'upper_right_eyelid1': 'head',
-		'upper_right_eyelid2': 'head',
-		'upper_right_eyelid3': 'head',
-		'upper_right_eyelid_fold': 'head',
-		'lowwer_right_eyelid1': 'head',
-		'lowwer_right_eyelid2': 'head',
-		'lowwer_right_eyelid3': 'head',
-		'lowwer_right_eyelid_fold': 'head',
-		
-		'tongue_left_side' : 'tongue2',
-		'tongue_right_side' : 'tongue2',
-		'tongue1' : 'jaw',
-		
-		'right_chick2': 'head',
-		'right_chick3': 'head',
-		'right_mouth_fold1': 'jaw',
-		'right_mouth2': 'jaw',
-		'right_mouth1': 'jaw',
-		'upper_right_lip': 'head',
-		'lowwer_right_lip': 'jaw',
-		'right_corner_lip2': 'jaw',
-		'right_corner_lip1': 'head',
-		'right_mouth3': 'head',
-		'right_mouth4': 'head',
-		'right_mouth_fold2': 'head',
-		'right_mouth_fold3': 'head',
-		'right_mouth_fold4': 'head',
-		
-		'left_temple': 'head',
-		'left_forehead': 'head',
-		'left_chick1': 'head',
-		'left_chick2': 'head',
-		'left_chick3': 'head',
-		'left_chick4': 'head',
-		'left_nose1': 'head',
-		'left_nose2': 'head',
-		'left_nose3': 'head',
-		'left_eyebrow1': 'head',
-		'left_eyebrow2': 'head',
-		'left_eyebrow3': 'head',
-		'left_eye': 'head',
-		
-		'upper_left_eyelid1': 'head',
-		'upper_left_eyelid2': 'head',
-		'upper_left_eyelid3': 'head',
-		'upper_left_eyelid_fold': 'head',
-		'lowwer_left_eyelid1': 'head',
-		'lowwer_left_eyelid2': 'head',
-		'lowwer_left_eyelid3': 'head',
-		'lowwer_left_eyelid_fold': 'head',
-
-		'upper_left_eyelash' : 'upper_left_eyelid2',  
-		'upper_right_eyelash' : 'upper_right_eyelid2',  
-		
-		'left_chick2': 'head',
-		'left_chick3': 'head',
-		'left_mouth_fold1': 'jaw',
-		'left_mouth2': 'jaw',
-		'left_mouth1': 'jaw',
-		'upper_left_lip': 'head',
-		'lowwer_left_lip': 'jaw',
-		'left_corner_lip2': 'jaw',
-		'left_corner_lip1': 'head',
-		'left_mouth3': 'head',
-		'left_mouth4': 'head',
-		'left_mouth_fold2': 'head',
-		'left_mouth_fold3': 'head',
-		'left_mouth_fold4': 'head',
-		
-		#util
-		'dyng_frontbag_01': 'torso',
-		'dyng_backbag_01' : 'pelvis',
-		'hinge_frontrag' : 'pelvis',
-		'dyng_back_belt_01' : 'torso2',
-		'dyng_front_belt_01' : 'torso2',
-		
-		#succubus
-		'dyng_tail_01': 'torso',
-		
-		# weapons
-		'steel_sword_scabbard_3' : 'steel_sword_scabbard_2',
-		'steel_sword_scabbard_2' : 'steel_sword_scabbard_1',
-		'steel_sword_scabbard_1' : 'torso3',
-		
-		'dyng_dagger_01' : 'pelvis',
-		
-		# medallions, necklaces
-		'dyng_pendant_01' : 'head',
-		'dyng_necklace_01' : 'torso3',
-		
-		'medalion_main_01' : 'r_medalion_03',
-		'r_medalion_03' : 'r_medalion_02',
-		'r_medalion_02' : 'torso3',
-		'l_medalion_03' : 'l_medalion_02',
-		'l_medalion_02' : 'torso3',
-		
-		'vesemir_medalion_main_01' : 'r_vesemir_medalion_02',
-		'r_vesemir_medalion_01' : 'torso3',
-		'l_vesemir_medalion_01' : 'torso3',
-		
-		'dyng_r_necklace_01' : 'torso3',
-		'dyng_l_necklace_01' : 'torso3',
-		'dyng_m_necklace_01' : 'dyng_l_necklace_02',
-		
-		# random clothes
-		'dyng_l_double_earing_01' : 'head',
-		'dyng_r_double_earing_01' : 'head',
-		
-		'hinge_l_collar' : 'torso3',
-		'hinge_r_collar' : 'torso3'
-	}
+	# Parent bones using the W3_BONE_PARENTS child:parent name dictionary.
 	
 	# Mode management
 	bpy.ops.object.mode_set(mode='OBJECT')
@@ -732,75 +1059,81 @@ def parent_w3_bones(armature):
 	bpy.ops.object.mode_set(mode='EDIT')
 	eb = armature.data.edit_bones
 	
-	def nearest_parent(bone_name):
-		# Recursive function to find a parent for a bone even if its direct parent bone is missing. 
-		if(bone_name == None):
-			return None
-		parent_name = parent_dict.get(bone_name)
-		if(parent_name != None): 
-			parent = eb.get(parent_name)
-			if(parent != None):
-				return parent
-			else:
-				# Recursion to keep searching for the nearest parent in the dictionary.
-				return nearest_parent(parent_name)
-			
-		# If we haven't returned yet, parent was not found in dictionary.
-		
-		# Bones ending in a number will be automatically parented to the bone with the same name but lower number.
-		try:
-			number = int(bone_name[-1])	# If the last character of the bone name is a number, just find the bone with the lower number.
-			if(number==1 and 'hair' in bone_name):
-				# This lets us avoid having to put every hair1 bone in the dict.
-				return eb.get('head')
-			else:
-				parent_name = bone_name[:-1] + str(number-1)
-				return eb.get(parent_name)
-		except ValueError:
-			# If converting to an int fails
-			pass
-		
-		# If we got this far, then we couldn't find a parent.
-		return None
-	
 	### Parenting the bones ###
+	parents = find_nearest_parents(eb)
 	for bone in eb:
-		parent = nearest_parent(bone.name)
-		if(parent != None):
-			bone.parent = parent
-		else:
-			continue
+		parent_name = parents.get(bone.name)
+		if(parent_name != None):
+			bone.parent = eb[parent_name]
 	
 	bpy.ops.object.mode_set(mode='OBJECT')
 
-def delete_unused_bones(armature):
+def used_vertex_group_names(objects, nonzero_weights=False):
+	# Returns the set of vertex group names used by these meshes.
+	# With nonzero_weights, only vertex groups that have at least one vertex with a weight above 0 count as used.
+	used = set()
+	for o in objects:
+		if(o.type != 'MESH'): continue
+		if(not nonzero_weights):
+			used.update(vg.name for vg in o.vertex_groups)
+			continue
+		used_indices = set()
+		for v in o.data.vertices:
+			for g in v.groups:
+				if(g.weight > 0):
+					used_indices.add(g.group)
+		used.update(vg.name for vg in o.vertex_groups if vg.index in used_indices)
+	return used
+
+def delete_unused_bones(armature, nonzero_weights=False):
 	# Unused meaning bones that don't have a vertex group on any of the armature's child meshes.
+	# Returns the names of the deleted bones.
 	# TODO make this a separate operator.
 	
+	used = used_vertex_group_names(armature.children, nonzero_weights)
+	
 	# Mode management
 	bpy.ops.object.mode_set(mode='OBJECT')
 	bpy.ops.object.select_all(action='DESELECT')
 	bpy.context.view_layer.objects.active = armature
 	bpy.ops.object.mode_set(mode='EDIT')
 	
-	vgs = []	# List to store all vertex groups' names used by all of the armature's child meshes.
-	for o in armature.children:
-		if(o.type != 'MESH'): continue
-		for vg in o.vertex_groups:
-			if(vg not in vgs):
-				vgs.append(vg.name)
-	
-	# Deleting bones that don't have a corresponding name in vgs.
-	bpy.context.view_layer.objects.active = armature
-	bpy.ops.object.mode_set(mode='EDIT')
-	for eb in reversed(armature.data.edit_bones):
-		if(eb.name not in vgs):
-			armature.data.edit_bones.remove(eb)
+	# Deleting bones that don't have a corresponding vertex group.
+	removed = []
+	edit_bones = armature.data.edit_bones
+	for eb in reversed(edit_bones):
+		if(eb.name not in used):
+			removed.append(eb.name)
+			edit_bones.remove(eb)
 	bpy.ops.object.mode_set(mode='OBJECT')
+	
+	import_profiler.count('bones_removed', len(removed))
+	return removed
+
+# Bone settings copied to the bones that combine_armatures() recreates. Some of them only exist in some Blender versions.
+# use_inherit_scale is before inherit_scale, which replaces it in newer versions and is more specific.
+BONE_SETTINGS = ['use_deform', 'use_inherit_rotation', 'use_inherit_scale', 'inherit_scale', 'use_local_location', 'use_relative_parent',
+	'envelope_distance', 'envelope_weight', 'head_radius', 'tail_radius',
+	'bbone_segments', 'bbone_x', 'bbone_z', 'bbone_easein', 'bbone_easeout', 'bbone_rollin', 'bbone_rollout', 'use_endroll_as_inroll',
+	'bbone_curveinx', 'bbone_curveiny', 'bbone_curveinz', 'bbone_curveoutx', 'bbone_curveouty', 'bbone_curveoutz',
+	'bbone_scalein', 'bbone_scaleout', 'bbone_scaleinx', 'bbone_scaleiny', 'bbone_scaleoutx', 'bbone_scaleouty',
+	'bbone_handle_type_start', 'bbone_handle_type_end', 'use_scale_easing']
+
+def bone_settings(bone):
+	# Returns (setting, value) of the BONE_SETTINGS of a bone. Vectors are converted to tuples, since they are only valid while the bone is.
+	settings = []
+	for attr in BONE_SETTINGS:
+		if(not hasattr(bone, attr)): continue
+		value = getattr(bone, attr)
+		if(hasattr(value, '__len__') and type(value) != str):
+			value = tuple(value)
+		settings.append( (attr, value) )
+	return settings
 
 def combine_armatures(armatures, main_armature=None):
 	# Combine a list of armatures into one while preventing duplicate bones.
 	# Child meshes will also be parented to the combined armature, and their armature modifier's target will be replaced.
+	# All the missing bones are created in the main armature in a single edit session, then the other armatures are deleted at once.
 	# Note: Does not combine hierarchies. parent_w3_bones should be called on the resulting armature.
 	
 	if(len(armatures)==0):return
@@ -808,119 +1141,158 @@ def combine_armatures(armatures, main_armature=None):
 	if(main_armature == None):
 		main_armature = armatures[0]
 	
+	others = [a for a in armatures if a.type == 'ARMATURE' and a != main_armature]
+	if(len(others) == 0):
+		return main_armature
+	
+	# Collecting the bones missing from the main armature, in the main armature's space. The first armature to have a bone wins.
+	main_inverse = main_armature.matrix_world.inverted()
+	main_bones = main_armature.data.bones
+	new_bones = {}	# Bone name : (matrix, length, parent name, use_connect, settings)
+	for a in others:
+		to_main = main_inverse @ a.matrix_world
+		for b in a.data.bones:
+			if(b.name in main_bones or b.name in new_bones): continue
+			head = to_main @ b.head_local
+			tail = to_main @ b.tail_local
+			matrix = (to_main @ b.matrix_local).normalized()
+			parent_name = b.parent.name if b.parent != None else None
+			new_bones[b.name] = (matrix, (tail-head).length, parent_name, b.use_connect, bone_settings(b))
+	
+	# Creating them
 	bpy.ops.object.mode_set(mode='OBJECT')
 	bpy.ops.object.select_all(action='DESELECT')
+	bpy.context.view_layer.objects.active = main_armature
+	bpy.ops.object.mode_set(mode='EDIT')
+	edit_bones = main_armature.data.edit_bones
+	for name, (matrix, length, parent_name, use_connect, settings) in new_bones.items():
+		eb = edit_bones.new(name)
+		eb.head = (0, 0, 0)
+		eb.tail = (0, 1, 0)
+		eb.matrix = matrix
+		eb.length = max(length, 0.0001)
+		for attr, value in settings:
+			if(hasattr(eb, attr)):
+				setattr(eb, attr, value)
+	for name, (matrix, length, parent_name, use_connect, settings) in new_bones.items():
+		if(parent_name != None):
+			eb = edit_bones.get(name)
+			eb.parent = edit_bones.get(parent_name)
+			# Connecting after parenting, since it moves the head to the parent's tail.
+			eb.use_connect = use_connect
+	bpy.ops.object.mode_set(mode='OBJECT')
 	
-	for a in armatures:
-		if(a.type != 'ARMATURE'):
-			continue
-		if(a == main_armature):
-			continue
-		
-		# Finding bones that exist in the main armature
-		duplicates = []
-		for b in a.data.bones:
-			if(b.name in main_armature.data.bones):
-				duplicates.append(b.name)
-		
-		# Deleting the bones that were found
-		bpy.context.view_layer.objects.active = a
-		bpy.ops.object.mode_set(mode='EDIT')
-		for eb in duplicates:
-			a.data.edit_bones.remove(a.data.edit_bones.get(eb))
-		bpy.ops.object.mode_set(mode='OBJECT')
-		
-		# Parenting child meshes of this armature to main armature
+	# Parenting child meshes of the other armatures to the main armature, while keeping their transforms.
+	for a in others:
 		for o in a.children:
-			o.select_set(True)
-		main_armature.select_set(True)
-		bpy.context.view_layer.objects.active = main_armature
-		bpy.ops.object.parent_set(type='ARMATURE')
-		
-		# Joining this armature with the main armature
-		bpy.ops.object.select_all(action='DESELECT')
-		a.select_set(True)
-		main_armature.select_set(True)
-		bpy.context.view_layer.objects.active = main_armature
-		bpy.ops.object.join()
-		
+			# World = parent world @ parent inverse @ local. Folding the old armature's world matrix into the parent inverse keeps the world matrix the same.
+			o.matrix_parent_inverse = main_inverse @ a.matrix_world @ o.matrix_parent_inverse
+			o.parent = main_armature
+			has_armature_modifier = False
+			for m in o.modifiers:
+				if(m.type == 'ARMATURE'):
+					has_armature_modifier = True
+					if(m.object == a or m.object == None):
+						m.object = main_armature
+			if(o.type == 'MESH' and not has_armature_modifier):
+				m = o.modifiers.new(name="Armature", type='ARMATURE')
+				m.object = main_armature
+	
+	# Deleting the other armatures, and their data.
+	datas = [a.data for a in others]
+	bpy.data.batch_remove(others)
+	orphans = [d for d in datas if d.users == 0]
+	if(len(orphans) > 0):
+		bpy.data.batch_remove(orphans)
+	
 	return main_armature
 
+# Dictionary to help connect the bone tails to specific bone heads, used by fix_bone_tail().
+W3_BONE_CONNECTIONS = {
+	'l_shoulder' 			: 'l_bicep'		,
+	'l_bicep' 				: 'l_elbowRoll'	,
+	'l_elbowRoll' 			: 'l_hand'		,
+	'l_hand' 				: 'l_middle1'	,
+	'l_thigh' 				: 'l_shin'		,
+	'l_shin' 				: 'l_foot'		,
+	'l_foot' 				: 'l_toe'		,
+	'l_index_knuckleRoll' 	: 'l_index2'	,
+	'l_middle_knuckleRoll' 	: 'l_middle2'	,
+	'l_ring_knuckleRoll' 	: 'l_ring2'		,
+
+	'r_shoulder' 			: 'r_bicep'		,
+	'r_bicep' 				: 'r_elbowRoll'	,
+	'r_elbowRoll' 			: 'r_hand'		,
+	'r_hand' 				: 'r_middle1'	,
+	'r_thigh' 				: 'r_shin'		,
+	'r_shin' 				: 'r_foot'		,
+	'r_foot' 				: 'r_toe'		,
+	'r_index_knuckleRoll' 	: 'r_index2'	,
+	'r_middle_knuckleRoll' 	: 'r_middle2'	,
+	'r_ring_knuckleRoll' 	: 'r_ring2'		,
+
+	'pelvis' 				: 'None'		,
+	'torso' 				: 'torso2'		,
+	'torso2' 				: 'torso3'		,
+	'torso3' 				: 'neck'		,
+	'neck' 					: 'head'		,
+	'head' 					: 'None'		,
+	'jaw' 					: 'chin'		,
+	'tongue2' 				: 'lowwer_lip'	,
+}
+
 def fix_bone_tail(edit_bones, bone=None):
-	# Recursive function to go through a bone hierarchy and move the bone tails to useful positions.
-	# Requires the armature to be in edit mode because I don't want to switch between object/edit in a recursive function.
+	# Go through a bone hierarchy and move the bone tails to useful positions.
+	# The hierarchy is walked breadth-first, so parents are always done before their children (which use the parent's direction), without recursion.
+	# Requires the armature to be in edit mode.
 	
 	if(len(edit_bones) == 0):
 		raise W3ImporterError("Armature needs to be in edit mode for fix_bone_tail().")
 	
-	# Dictionary to help connect the bone tails to specific bone heads
-	connect_dict = {
-		'l_shoulder' 			: 'l_bicep'		,
-		'l_bicep' 				: 'l_elbowRoll'	,
-		'l_elbowRoll' 			: 'l_hand'		,
-		'l_hand' 				: 'l_middle1'	,
-		'l_thigh' 				: 'l_shin'		,
-		'l_shin' 				: 'l_foot'		,
-		'l_foot' 				: 'l_toe'		,
-		'l_index_knuckleRoll' 	: 'l_index2'	,
-		'l_middle_knuckleRoll' 	: 'l_middle2'	,
-		'l_ring_knuckleRoll' 	: 'l_ring2'		,
-
-		'r_shoulder' 			: 'r_bicep'		,
-		'r_bicep' 				: 'r_elbowRoll'	,
-		'r_elbowRoll' 			: 'r_hand'		,
-		'r_hand' 				: 'r_middle1'	,
-		'r_thigh' 				: 'r_shin'		,
-		'r_shin' 				: 'r_foot'		,
-		'r_foot' 				: 'r_toe'		,
-		'r_index_knuckleRoll' 	: 'r_index2'	,
-		'r_middle_knuckleRoll' 	: 'r_middle2'	,
-		'r_ring_knuckleRoll' 	: 'r_ring2'		,
-
-		'pelvis' 				: 'None'		,
-		'torso' 				: 'torso2'		,
-		'torso2' 				: 'torso3'		,
-		'torso3' 				: 'neck'		,
-		'neck' 					: 'head'		,
-		'head' 					: 'None'		,
-		'jaw' 					: 'chin'		,
-		'tongue2' 				: 'lowwer_lip'	,
-	}
-	
 	if(bone == None):
 		bone=edit_bones[0]
 	
-	# If a bone is in connect_dict, just move its tail to the bone specified in the dictionary.
-	if(bone.name in connect_dict):
-		target = edit_bones.get(connect_dict[bone.name])
-		if(target != None):
-			bone.tail = target.head
-	else:
-		# For bones with children, we'll just connect the bone to the first child.
-		if(len(bone.children) > 0):
-			bone.tail = bone.children[0].head
-		
-		# For bones with no children...
+	# Reading EditBone.children loops over every bone of the armature, so build the child lists once.
+	children = {}
+	for eb in edit_bones:
+		if(eb.parent != None):
+			children.setdefault(eb.parent.name, []).append(eb)
+	
+	queue = deque([bone])
+	while(len(queue) > 0):
+		bone = queue.popleft()
+		bone_children = children.get(bone.name, [])
+		
+		# If a bone is in W3_BONE_CONNECTIONS, just move its tail to the bone specified in the dictionary.
+		if(bone.name in W3_BONE_CONNECTIONS):
+			target = edit_bones.get(W3_BONE_CONNECTIONS[bone.name])
+			if(target != None):
+				bone.tail = target.head
 		else:
-			if(bone.parent != None):
-				# Get the parent's head->tail vector
-				parent_vec = bone.parent.tail - bone.parent.head
-				# If the bone has siblings, set the scale to an arbitrary amount.
-				if( len(bone.parent.children) > 1): 
-					scale = 0.1
-					if('tongue' in bone.name): scale = 0.03
-					bone.tail = bone.head + parent_vec.normalized() * scale	# Todo change this number to .05 if the apply_transforms() gets fixed.
-				# If no siblings, just use the parents transforms.
-				else:
-					bone.tail = bone.head + parent_vec
-				
-				# Special treatment for the children of some bones
-				if(bone.parent.name in ['head', 'jaw']):
-					bone.tail = bone.head+Vector((0, 0, .02))
-	
-	# Recursion over this bone's children.
-	for c in bone.children:
-		fix_bone_tail(edit_bones, c)
+			# For bones with children, we'll just connect the bone to the first child.
+			if(len(bone_children) > 0):
+				bone.tail = bone_children[0].head
+			
+			# For bones with no children...
+			else:
+				parent = bone.parent
+				if(parent != None):
+					# Get the parent's head->tail vector
+					parent_vec = parent.tail - parent.head
+					# If the bone has siblings, set the scale to an arbitrary amount.
+					if( len(children[parent.name]) > 1): 
+						scale = 0.1
+						if('tongue' in bone.name): scale = 0.03
+						bone.tail = bone.head + parent_vec.normalized() * scale	# Todo change this number to .05 if the apply_transforms() gets fixed.
+					# If no siblings, just use the parents transforms.
+					else:
+						bone.tail = bone.head + parent_vec
+					
+					# Special treatment for the children of some bones
+					if(parent.name in ['head', 'jaw']):
+						bone.tail = bone.head+Vector((0, 0, .02))
+		
+		queue.extend(bone_children)
 
 def cleanup_w3_armature(arm, char_name = ''):
 	# For scaling bones, fixing hierarchy, recalculating rolls, renaming unique bones, cleaning unused bones, enabling x-ray.
@@ -962,42 +1334,162 @@ def cleanup_w3_armature(arm, char_name = ''):
 	
 	print("Armature cleaned up: "+arm.name)
 
-def import_w3_fbx(filepath, uncook_path, remove_doubles=True, keep_lod_meshes=False, quadrangulate=True, fix_armature=True):
-	append_resources()
+def is_lod_object(obj):
+	return ("lod1" in obj.name) or ("lod2" in obj.name) or ("lod3" in obj.name)
+
+def remove_lod_objects(objects):
+	# Deletes LOD objects, along with the meshes, materials and images that were only used by them.
+	# The FBX importer can't skip objects, so this is done right after the import, in bulk.
+	lods = [o for o in objects if is_lod_object(o)]
+	if(len(lods) == 0):
+		return
+	
+	datas = set()
+	materials = set()
+	images = set()
+	for o in lods:
+		if(o.data == None): continue
+		datas.add(o.data)
+		if(o.type != 'MESH'): continue
+		for m in o.data.materials:
+			if(m == None): continue
+			materials.add(m)
+			if(m.node_tree == None): continue
+			for n in m.node_tree.nodes:
+				if(n.type == 'TEX_IMAGE' and n.image != None):
+					images.add(n.image)
+	
+	bpy.data.batch_remove(lods)
+	# Each pass can orphan datablocks used by the ones removed in the previous pass.
+	removed = len(lods)
+	for candidates in (datas, materials, images):
+		orphans = [datablock for datablock in candidates if datablock.users == 0]
+		if(len(orphans) > 0):
+			bpy.data.batch_remove(orphans)
+		removed += len(orphans)
+	import_profiler.count('lod_objects_removed', len(lods))
+	import_profiler.count('lod_datablocks_removed', removed - len(lods))
+
+# Datablock types swept by sweep_orphans(), in an order where removing one type can only orphan the types after it.
+SWEPT_DATABLOCKS = ['meshes', 'armatures', 'materials', 'images']
+
+def snapshot_datablocks():
+	# Returns the pointers of the existing datablocks of the swept types, so sweep_orphans() doesn't touch anything that existed before the import.
+	return {name : set(datablock.as_pointer() for datablock in getattr(bpy.data, name)) for name in SWEPT_DATABLOCKS}
+
+def datablock_memory(datablock):
+	# Rough size in bytes of the data of a mesh or image. Other types count as 0.
+	if(type(datablock) == bpy.types.Image):
+		if(not datablock.has_data):
+			return 0
+		bytes_per_channel = 4 if datablock.is_float else 1
+		return datablock.size[0] * datablock.size[1] * datablock.channels * bytes_per_channel
+	if(type(datablock) == bpy.types.Mesh):
+		# Sizes of Blender's vertex, edge, face and face corner structs, and the UVs of each face corner.
+		return len(datablock.vertices)*20 + len(datablock.edges)*12 + len(datablock.polygons)*12 + len(datablock.loops)*(8 + 12*len(datablock.uv_layers))
+	return 0
+
+def sweep_orphans(snapshot):
+	# Deletes the datablocks that were created since the snapshot and have no users, like the FBX materials replaced by duplicates,
+	# and the meshes and armatures of merged or deleted objects. Returns {type : number of datablocks removed}.
+	removed = {}
+	freed = 0
+	for name in SWEPT_DATABLOCKS:
+		old = snapshot.get(name, set())
+		orphans = [datablock for datablock in getattr(bpy.data, name)
+			if datablock.users == 0 and not datablock.use_fake_user and datablock.as_pointer() not in old]
+		freed += sum(datablock_memory(datablock) for datablock in orphans)
+		if(len(orphans) > 0):
+			bpy.data.batch_remove(orphans)
+		removed[name] = len(orphans)
+		import_profiler.count('orphan_' + name + '_removed', len(orphans))
+	import_profiler.count('orphan_bytes_freed', freed)
+	print("Removed orphan datablocks: %s (%.1f MB)" %(", ".join("%d %s" %(count, name) for name, count in removed.items()), freed / (1024*1024)))
+	return removed
+
+def import_w3_fbx(filepath, uncook_path, remove_doubles=True, keep_lod_meshes=False, quadrangulate=True, fix_armature=True, use_texture_index=False, use_cache=False, link_resources=False, lazy_textures=False, use_templates=True):
+	with import_profiler.stage('append_resources'):
+		append_resources(link_resources)
 	
 	if filepath.endswith(".fbx"):
-		filename = filepath.split("\\")[-1].split(".")[0]
-		print("...Importing FBX: "+filename)
+		import_profiler.profiler.begin_file(filepath)
+		try:
+			if(not use_cache):
+				return import_w3_fbx_file(filepath, uncook_path, remove_doubles, keep_lod_meshes, quadrangulate, fix_armature, use_texture_index, lazy_textures, use_templates)
+			
+			# Everything that affects the result of importing this file goes into the cache key.
+			options = {
+				'uncook_path' : uncook_path,
+				'remove_doubles' : remove_doubles,
+				'keep_lod_meshes' : keep_lod_meshes,
+				'quadrangulate' : quadrangulate,
+				'fix_armature' : fix_armature,
+				'lazy_textures' : lazy_textures,
+				# Cached materials use the preview images when the session did.
+				'preview_factor' : preview_factor,
+			}
+			with import_profiler.stage('cache_load'):
+				key = import_cache.cache_key(filepath, filepath.replace(".fbx", ".xml"), options)
+				objects = import_cache.load(key)
+			if(objects != None):
+				print("...Loaded from import cache: " + filepath)
+				import_profiler.count('cache_hits')
+				for o in objects[0]:
+					for m in o.data.materials:
+						if(m != None and 'witcher3_mat_hash' in m):
+							index_material(m)
+				return objects
+			
+			objects = import_w3_fbx_file(filepath, uncook_path, remove_doubles, keep_lod_meshes, quadrangulate, fix_armature, use_texture_index, lazy_textures, use_templates)
+			with import_profiler.stage('cache_store'):
+				import_cache.store(key, objects[0] + objects[1])
+			return objects
+		finally:
+			import_profiler.profiler.end_file()
+	return [[], []]
+
+def import_w3_fbx_file(filepath, uncook_path, remove_doubles, keep_lod_meshes, quadrangulate, fix_armature, use_texture_index, lazy_textures, use_templates=True):
+	filename = filepath.split("\\")[-1].split(".")[0]
+	print("...Importing FBX: "+filename)
+	with import_profiler.stage('fbx_import'):
 		enable_print(False)
 		bpy.ops.import_scene.fbx( filepath = filepath )	# The imported objects automatically became selected on import.
 		enable_print(True)
-		obj_name = filename
-		
-		# Discarding LOD meshes.
-		if(not keep_lod_meshes):
-			for o in reversed(bpy.context.selected_objects):
-				if( ("lod1" in o.name) or ("lod2" in o.name) or ("lod3" in o.name) ):
-					bpy.data.objects.remove(o)
-		
-		armatures = []
-		meshes = []
-		for o in bpy.context.selected_objects:
-			bpy.ops.object.select_all(action='DESELECT')
-			assert o.type != 'EMPTY', "You didn't fix import_fbx.py"
-			if(o.type == 'MESH'):
-				meshes.append(o)
-				o.name = obj_name
+	obj_name = filename
+	
+	# Discarding LOD meshes.
+	if(not keep_lod_meshes):
+		with import_profiler.stage('lod_removal'):
+			remove_lod_objects(bpy.context.selected_objects)
+	
+	armatures = []
+	meshes = []
+	xml_path = filepath.replace(".fbx", ".xml")
+	for o in bpy.context.selected_objects:
+		bpy.ops.object.select_all(action='DESELECT')
+		assert o.type != 'EMPTY', "You didn't fix import_fbx.py"
+		if(o.type == 'MESH'):
+			meshes.append(o)
+			o.name = obj_name
+			import_profiler.count('meshes')
+			import_profiler.count('vertices', len(o.data.vertices))
+			with import_profiler.stage('cleanup_mesh'):
 				enable_print(False)
-				cleanup_mesh.cleanup_mesh(o, remove_doubles, quadrangulate, weight_normals=True, seams_from_islands=True)
+				cleanup_mesh.cleanup_mesh_bmesh(o, remove_doubles, quadrangulate, weight_normals=True, seams_from_islands=True)
 				enable_print(True)
-				load_w3_materials(o, filepath.replace(".fbx", ".xml"))
-			if(o.type == 'ARMATURE'):
-				o.name = obj_name + "_Skeleton"
-				armatures.append(o)
-				if(fix_armature):
+			with import_profiler.stage('materials'):
+				load_w3_materials(o, xml_path, uncook_path, use_texture_index, lazy_textures, use_templates)
+		if(o.type == 'ARMATURE'):
+			o.name = obj_name + "_Skeleton"
+			armatures.append(o)
+			if(fix_armature):
+				with import_profiler.stage('armature_cleanup'):
 					cleanup_w3_armature(o)
-			o.data.name = "Data_" + o.name
-		
+		o.data.name = "Data_" + o.name
+	# Every mesh of this FBX has its materials now.
+	xml_cache.pop(xml_path, None)
+	
+	with import_profiler.stage('parenting'):
 		bpy.ops.object.mode_set(mode='OBJECT')
 		bpy.ops.object.select_all(action='DESELECT')
 		
@@ -1019,46 +1511,63 @@ def import_w3_fbx(filepath, uncook_path, remove_doubles=True, keep_lod_meshes=Fa
 			bpy.ops.object.transform_apply(location=False, rotation=True, scale=True)
 			bpy.context.view_layer.objects.active=armatures[0]
 			bpy.ops.object.parent_set(type='ARMATURE')
-			
-		return [meshes, armatures]
-	return [[], []]
+		
+	return [meshes, armatures]
 
-def batch_import_w3_fbx(paths, uncook_path, char_name = '', recursive=False, keep_lod_meshes=False, remove_doubles=True, quadrangulate=True, combined_armatures=True):
-	# Importing FBX's
-	all_objects = [[], []]	# First list is for meshes, second list is armatures.
+def batch_import_w3_fbx(paths, uncook_path, char_name = '', recursive=False, keep_lod_meshes=False, remove_doubles=True, quadrangulate=True, combined_armatures=True, use_texture_index=False, use_cache=False, link_resources=False, lazy_textures=False, texture_resolution='FULL', use_templates=True):
+	reset_import_session()
+	# Remembering what existed before the import, so only datablocks orphaned by the import get deleted at the end.
+	existing_datablocks = snapshot_datablocks()
 	
+	# Collecting file paths
+	filepaths = []
 	# Assume paths is a list of filepaths.
 	if(type(paths)==list):
-		for filepath in paths:
-			objects = import_w3_fbx(filepath, uncook_path, remove_doubles, keep_lod_meshes, quadrangulate, fix_armature=False)
-			all_objects[0].extend(objects[0])
-			all_objects[1].extend(objects[1])
+		filepaths = paths[:]
 	# Assume paths is a folder path.
 	else:
 		import_path = paths
 		for subdir, dirs, files in os.walk(import_path):
 			for file in files:
-				filepath = subdir + os.sep + file
-				objects = import_w3_fbx(filepath, uncook_path, remove_doubles, keep_lod_meshes, quadrangulate, fix_armature=False)
-				all_objects[0].extend(objects[0])
-				all_objects[1].extend(objects[1])
+				filepaths.append(subdir + os.sep + file)
 			if(not recursive): break;
 	
+	# Parsing all the XMLs in the background while the FBXs are being imported.
+	prefetch_xmls(filepaths, uncook_path=uncook_path, use_texture_index=use_texture_index)
+	# Making downscaled textures in the background too, if they are needed.
+	start_texture_previews([p.replace(".fbx", ".xml") for p in filepaths if p.endswith(".fbx")], uncook_path, use_texture_index, texture_resolution)
+	
+	# Importing FBX's
+	all_objects = [[], []]	# First list is for meshes, second list is armatures.
+	try:
+		for filepath in filepaths:
+			objects = import_w3_fbx(filepath, uncook_path, remove_doubles, keep_lod_meshes, quadrangulate, fix_armature=False, use_texture_index=use_texture_index, use_cache=use_cache, link_resources=link_resources, lazy_textures=lazy_textures, use_templates=use_templates)
+			all_objects[0].extend(objects[0])
+			all_objects[1].extend(objects[1])
+	finally:
+		stop_xml_prefetch()
+	
 	armatures = all_objects[1]
 	
 	# Combine armatures & clean up
 	if(combined_armatures):
-		main_armature = combine_armatures(all_objects[1])
+		with import_profiler.stage('combine_armatures'):
+			main_armature = combine_armatures(all_objects[1])
 		if(main_armature):
 			main_armature.name = 'Witcher3_Skeleton_' + char_name
-			cleanup_w3_armature(main_armature, char_name)
+			with import_profiler.stage('armature_cleanup'):
+				cleanup_w3_armature(main_armature, char_name)
 			armatures = [main_armature]
 	
 	for a in armatures:
 		# Cleaning unused bones
-		delete_unused_bones(a)
+		with import_profiler.stage('delete_unused_bones'):
+			removed_bones = delete_unused_bones(a)
+		if(len(removed_bones) > 0):
+			print("Deleted %d unused bones from %s" %(len(removed_bones), a.name))
 		# Fixing bone hierarchy
-		parent_w3_bones(a)
+		with import_profiler.stage('parent_bones'):
+			parent_w3_bones(a)
 	
 	# Create a collection with all imported objects
 	coll = bpy.data.collections.new(char_name)
@@ -1070,6 +1579,11 @@ def batch_import_w3_fbx(paths, uncook_path, char_name = '', recursive=False, kee
 		# Add to the new collection
 		coll.objects.link(o)
 	
+	with import_profiler.stage('orphan_sweep'):
+		sweep_orphans(existing_datablocks)
+	
+	import_profiler.profiler.finish()
+	
 class BatchImportW3FBX(Operator, ImportHelper):
 	"""MAKE SURE YOU HAVE SYSTEM CONSOLE OPEN. Select an entire character folder or single FBX file. If you select multiple characters, all their skeletons will be merged into one, not recommended."""
 	bl_idname = "import_scene.witcher3_fbx_batch"
@@ -1120,6 +1634,35 @@ class BatchImportW3FBX(Operator, ImportHelper):
 		description="Merge all armatures into one"
 	)
 	
+	lazy_textures: BoolProperty(
+		name="Deferred Texture Loading",
+		default=False,
+		description="Don't load textures during the import, only remember which ones to use. Load them later with the Load Witcher 3 Textures operator"
+	)
+	
+	texture_resolution: EnumProperty(
+		name="Texture Resolution",
+		items=[
+			('FULL', "Full", "Use the textures from the Uncooked folder"),
+			('HALF', "Half", "Use half resolution copies of the textures, made in parallel and cached. Switch to full resolution with the Witcher 3 Texture Resolution operator"),
+			('QUARTER', "Quarter", "Use quarter resolution copies of the textures, made in parallel and cached. Switch to full resolution with the Witcher 3 Texture Resolution operator"),
+		],
+		default='FULL',
+		description="Resolution of the textures used by the imported materials, when importing multiple files"
+	)
+	
+	dry_run: BoolProperty(
+		name="Dry Run",
+		default=False,
+		description="Don't import anything, only check the files and print what would be imported, which textures are missing, and an estimate of the import time"
+	)
+	
+	save_report: BoolProperty(
+		name="Save Import Report",
+		default=False,
+		description="Save the time spent in each import stage per file, as a .json file next to the imported files. A summary is always printed to the console"
+	)
+	
 	files: CollectionProperty(
 		name="File Path",
 		description=(
@@ -1134,6 +1677,11 @@ class BatchImportW3FBX(Operator, ImportHelper):
 	
 		char_name = self.char_name
 		uncook_path = addon_prefs.uncook_path
+		use_texture_index = addon_prefs.use_texture_index
+		use_cache = addon_prefs.use_import_cache
+		import_cache.max_size = addon_prefs.import_cache_size * 1024 * 1024
+		link_resources = addon_prefs.link_node_groups
+		use_templates = addon_prefs.use_material_templates
 		import_path = self.filepath	# self.filepath provided by ImportHelper.
 		recursive = self.recursive
 		keep_lod_meshes = self.keep_lod_meshes
@@ -1141,6 +1689,8 @@ class BatchImportW3FBX(Operator, ImportHelper):
 		quadrangulate = self.quadrangulate
 		combined_armatures = self.combined_armatures
 		
+		reset_import_session()
+		
 		paths = [os.path.join(self.directory, name.name)
 			for name in self.files]
 
@@ -1156,18 +1706,43 @@ class BatchImportW3FBX(Operator, ImportHelper):
 		if(uncook_path == 'E:\\Path_to_your_uncooked_folder\\Uncooked\\'):
 			raise W3ImporterError("Please browse your Uncooked folder in the Addon Preferences UI in Edit->Preferences->Addons->Witcher 3 FBX Import Tools.")
 		
+		if(self.dry_run):
+			texture_index = get_texture_index(uncook_path) if use_texture_index else None
+			# Same choice between files and folder as below.
+			plan_paths = paths if (len(paths) > 1 or import_path.endswith(".fbx")) else import_path
+			plan = import_planner.plan_import(plan_paths, uncook_path, recursive, texture_index)
+			import_planner.print_plan(plan)
+			if(self.save_report):
+				report_name = (char_name if char_name not in ["", "Character Name"] else "witcher3") + "_import_plan.json"
+				report_path = os.path.join(os.path.dirname(import_path), report_name)
+				import_planner.save_plan(plan, report_path)
+				print("Import plan saved: " + report_path)
+			summary = plan['summary']
+			self.report({'INFO'}, "%d files, %d missing textures, %d errors. See the console." %(summary['fbx_files'], summary['missing_textures'], summary['errors']))
+			return {'FINISHED'}
+		
 		# If a single file was selected
 		if(import_path.endswith(".fbx") and len(paths)==1):
-			import_w3_fbx(import_path, uncook_path, remove_doubles, keep_lod_meshes, quadrangulate, fix_armature=True)
+			import_w3_fbx(import_path, uncook_path, remove_doubles, keep_lod_meshes, quadrangulate, fix_armature=True, use_texture_index=use_texture_index, use_cache=use_cache, link_resources=link_resources, lazy_textures=self.lazy_textures, use_templates=use_templates)
 			pass
 		# If multiple files were selected
 		elif(len(paths) > 1):
 			if(char_name == "" or char_name== "Character Name"):	# If no character name is specified, use folder name.
 				char_name = os.path.dirname(import_path).split("\\")[-1].capitalize()
-			batch_import_w3_fbx(paths, uncook_path, char_name, recursive, keep_lod_meshes, remove_doubles, quadrangulate, combined_armatures)
+			batch_import_w3_fbx(paths, uncook_path, char_name, recursive, keep_lod_meshes, remove_doubles, quadrangulate, combined_armatures, use_texture_index, use_cache, link_resources, self.lazy_textures, self.texture_resolution, use_templates)
 		# No files were selected, so we import the entire folder
 		else:
-			batch_import_w3_fbx(import_path, uncook_path, char_name, recursive, keep_lod_meshes, remove_doubles, quadrangulate, combined_armatures)
+			batch_import_w3_fbx(import_path, uncook_path, char_name, recursive, keep_lod_meshes, remove_doubles, quadrangulate, combined_armatures, use_texture_index, use_cache, link_resources, self.lazy_textures, self.texture_resolution, use_templates)
+		
+		profiler = import_profiler.profiler
+		profiler.finish()
+		profiler.print_summary()
+		image_pool.print_report()
+		if(self.save_report):
+			report_name = (char_name if char_name not in ["", "Character Name"] else "witcher3") + "_import_report.json"
+			report_path = os.path.join(os.path.dirname(import_path), report_name)
+			profiler.save_report(report_path)
+			print("Import report saved: " + report_path)
 		return {'FINISHED'}
 
 def menu_func_import(self, context):
@@ -1210,6 +1785,12 @@ class ImportW3FBX(Operator):
 		description="Runs the Tris to Quads operator on imported meshes with UV seams enabled. Therefore it shouldn't break anything"
 	)
 	
+	lazy_textures: BoolProperty(
+		name="Deferred Texture Loading",
+		default=False,
+		description="Don't load textures during the import, only remember which ones to use. Load them later with the Load Witcher 3 Textures operator"
+	)
+	
 	import_path: StringProperty(
 		name="Import Path",
 		subtype="FILE_PATH",
@@ -1221,6 +1802,11 @@ class ImportW3FBX(Operator):
 		preferences = context.preferences
 		addon_prefs = preferences.addons[__package__].preferences
 		uncook_path = addon_prefs.uncook_path
+		use_texture_index = addon_prefs.use_texture_index
+		use_cache = addon_prefs.use_import_cache
+		import_cache.max_size = addon_prefs.import_cache_size * 1024 * 1024
+		link_resources = addon_prefs.link_node_groups
+		use_templates = addon_prefs.use_material_templates
 		
 		import_path = self.import_path
 		keep_lod_meshes = self.keep_lod_meshes
@@ -1230,7 +1816,74 @@ class ImportW3FBX(Operator):
 		fix_armature = self.fix_armature
 		
 		if(import_now):
-			import_w3_fbx(import_path, uncook_path, remove_doubles, keep_lod_meshes, quadrangulate, fix_armature)
+			reset_import_session()
+			import_w3_fbx(import_path, uncook_path, remove_doubles, keep_lod_meshes, quadrangulate, fix_armature, use_texture_index, use_cache, link_resources, self.lazy_textures, use_templates)
+		return {'FINISHED'}
+
+class LoadW3Textures(Operator):
+	"""Load the textures of Witcher 3 materials that were imported with Deferred Texture Loading"""
+	bl_idname = "object.witcher3_load_textures"
+	bl_label = "Load Witcher 3 Textures"
+	bl_options = {'REGISTER', 'UNDO'}
+	
+	selected_only: BoolProperty(
+		name="Selected Only",
+		default=True,
+		description="Only load the textures of the materials of the selected objects"
+	)
+	
+	background: BoolProperty(
+		name="In Background",
+		default=False,
+		description="Load a few textures at a time while Blender keeps running, instead of all at once"
+	)
+	
+	textures_per_step = 4
+	
+	def execute(self, context):
+		objects = context.selected_objects if self.selected_only else bpy.data.objects
+		materials = set()
+		for o in objects:
+			for slot in o.material_slots:
+				if(slot.material != None):
+					materials.add(slot.material)
+		jobs = deferred_texture_nodes(materials)
+		
+		if(not self.background):
+			for job in jobs:
+				load_deferred_texture(*job)
+			self.report({'INFO'}, "Loaded %d textures." %len(jobs))
+			return {'FINISHED'}
+		
+		# The operator is freed once it finishes, so the timer mustn't use self.
+		per_step = self.textures_per_step
+		def load_step():
+			for i in range(min(per_step, len(jobs))):
+				load_deferred_texture(*jobs.pop())
+			if(len(jobs) == 0):
+				print("Finished loading deferred textures.")
+				return None
+			return 0.01
+		
+		bpy.app.timers.register(load_step)
+		self.report({'INFO'}, "Loading %d textures in the background." %len(jobs))
+		return {'FINISHED'}
+
+class SetW3TextureResolution(Operator):
+	"""Switch textures that were imported at a lower resolution between their preview and the full resolution"""
+	bl_idname = "image.witcher3_texture_resolution"
+	bl_label = "Witcher 3 Texture Resolution"
+	bl_options = {'REGISTER', 'UNDO'}
+	
+	use_previews: BoolProperty(
+		name="Use Previews",
+		default=False,
+		description="Use the lower resolution previews. Disable for final renders"
+	)
+	
+	def execute(self, context):
+		switched = set_texture_resolution(bpy.data.images, self.use_previews)
+		self.report({'INFO'}, "Switched %d images." %switched)
 		return {'FINISHED'}
 
 class CombineArmatures(Operator):
@@ -1254,10 +1907,14 @@ def register():
 	bpy.utils.register_class(BatchImportW3FBX)
 	bpy.utils.register_class(ImportW3FBX)
 	bpy.utils.register_class(CombineArmatures)
+	bpy.utils.register_class(LoadW3Textures)
+	bpy.utils.register_class(SetW3TextureResolution)
 
 def unregister():
 	bpy.types.TOPBAR_MT_file_import.remove(menu_func_import)
 	from bpy.utils import unregister_class
 	bpy.utils.unregister_class(BatchImportW3FBX)
 	bpy.utils.unregister_class(ImportW3FBX)
+	bpy.utils.unregister_class(LoadW3Textures)
+	bpy.utils.unregister_class(SetW3TextureResolution)
 	bpy.utils.unregister_class(CombineArmatures)
\ No newline at end of file
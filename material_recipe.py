@@ -0,0 +1,268 @@
+# Blender Witcher 3 Importer Add-on
+# Copyright (C) 2019 Mets3D
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Material recipes: a description of the node tree of a Witcher 3 material, compiled from its XML parameters.
+# Recipes are made of tuples only, so they are hashable and picklable. They can be compiled on background threads or other processes,
+# and are turned into nodes by instantiate_recipe() in import_witcher3_fbx.py.
+# This file must not import bpy.
+
+import hashlib
+from collections import namedtuple
+
+# A node to create. Links refer to nodes by their index in MaterialRecipe.nodes.
+#	kind: bl_idname of the node.
+#	name: Node name, or None to keep Blender's default.
+#	props: (attribute, value) pairs set on the node.
+#	inputs, outputs: (socket index, default value) pairs.
+#	group: Name of the node group used by a group node.
+#	texture: TextureSpec of an image node.
+NodeSpec = namedtuple('NodeSpec', ['kind', 'name', 'label', 'location', 'width', 'hide', 'props', 'inputs', 'outputs', 'group', 'texture'],
+	defaults=[None, "", (0, 0), None, False, (), (), (), None, None])
+
+# A link between two nodes. Sockets are indices, or names for the node group's inputs, which are skipped if the group doesn't have them.
+# With only_if_free, the link is skipped if the input is already linked.
+LinkSpec = namedtuple('LinkSpec', ['from_node', 'from_socket', 'to_node', 'to_socket', 'only_if_free'], defaults=[False])
+
+# A texture of an image node. path is the absolute path of the .tga, or None if it wasn't found.
+TextureSpec = namedtuple('TextureSpec', ['value', 'path', 'non_color', 'normal_map'])
+
+# param_nodes are the indices of the nodes made from parameters, which should be linked to the node group.
+MaterialRecipe = namedtuple('MaterialRecipe', ['base', 'shader_type', 'group', 'nodes', 'links', 'param_nodes'])
+
+# Witcher 3 shaders that use the Witcher3_Main node group. (This is currently redundant since we will default to this anyways)
+MATERIAL_MAIN = ['pbr_std',
+	'pbr_std_colorshift',
+	'pbr_std_tint_mask_2det',
+	'pbr_std_tint_mask_2det_fresnel',
+	'pbr_std_tint_mask_det',
+	'pbr_std_tint_mask_det_fresnel',
+	'pbr_std_tint_mask_det_pattern',
+	'pbr_spec_tint_mask_det',
+	'pbr_spec',
+	'transparent_lit',
+	'transparent_lit_vert',
+	'transparent_reflective',
+	'pbr_simple',
+	'pbr_simple_noemissive',
+	'pbr_det']
+
+# Witcher 3 shaders that use the Witcher3_Skin node group.
+MATERIAL_SKIN = ['pbr_skin',
+	'pbr_skin_decal',
+	'pbr_skin_simple',
+	'pbr_skin_normalblend',
+	'pbr_skin_morph']
+
+# Witcher 3 shaders that use the Witcher3_Hair node group.
+MATERIAL_HAIR = ['pbr_hair',
+	'pbr_hair_simple',
+	'pbr_hair_moving']
+
+# Witcher 3 shaders that will use the Witcher3_Eye node group.
+MATERIAL_EYE = ['pbr_eye']
+
+SHADER_GROUPS = {}
+for shader in MATERIAL_MAIN:	SHADER_GROUPS[shader] = 'Witcher3_Main'
+for shader in MATERIAL_SKIN:	SHADER_GROUPS[shader] = 'Witcher3_Skin'
+for shader in MATERIAL_HAIR:	SHADER_GROUPS[shader] = 'Witcher3_Hair'
+for shader in MATERIAL_EYE:		SHADER_GROUPS[shader] = 'Witcher3_Main'	# 'Witcher3_Eye'
+
+EQUIVALENT_PARAMS = {	# TODO: I should probably go about this in a better way. It should probably be a Pin:[Equivalents] dict, not an equivalent:pin dict.
+	'Diffusemap' : 'Diffuse',
+	'Normalmap' : 'Normal',
+	'Ambientmap' : 'TintMask'
+	}
+
+IGNORED_PARAMS = ['DetailRange',
+'Pattern_Array', 'Pattern_Mixer', 'Pattern_Index', 'Pattern_Offset', 'Pattern_Size', 'Pattern_DistortionPower', 'Pattern_Rotation', 'handle:CTextureArray', 'Pattern_Roughness_Influence', 'Pattern_Color1', 'Pattern_Color2', 'Pattern_Color3']	# These Pattern textures are hidden in a .texarr file so we can't get any use out of them.
+
+# Textures that contain color. Every other texture is data, like normal maps and masks.
+COLOR_TEXTURES = ['Diffuse', 'SpecularTexture', 'TintMask']
+
+# Order in which the input nodes are created, from top to bottom. Purely for neatness.
+PARAM_ORDER = ['Diffuse', 'Normal', 'Ambient', 'TintMask', 'SpecularTexture', 'SpecularColor',
+	'RSpecScale', 'RSpecBase',
+	'Anisotropy', 'SpecularShiftTexture', 'SpecularShiftUVScale', 'SpecularShiftScale',
+	'Translucency', 'TranslucencyRim', 'TranslucencyRimScale',
+	'FresnelStrength', 'FresnelPower',
+	'AOPower', 'AmbientPower',
+	'DetailPower',
+	'DetailNormal', 'DetailTile', 'DetailRange', 'DetailRotation',
+	'DetailNormal1', 'DetailTile1', 'DetailRange1', 'DetailRotation1',
+	'Detail1Normal', 'Detail1Tile', 'Detail1Range', 'Detail1Rotation',
+	'Detail2Normal', 'Detail2Tile', 'Detail2Range', 'Detail2Rotation',
+	'DetailNormal2', 'DetailTile2', 'DetailRange2', 'DetailRotation2',
+	]
+
+def order_elements_by_attribute(elements, order, attribute='name'):
+	# Function that returns a list of records (like W3Param) ordered by the value of an attribute and an arbitrary order.
+	# Elements with the same value keep their original order, elements whose value isn't in the order go at the end.
+	rank = {}
+	for i, name in enumerate(order):
+		rank.setdefault(name, i)
+	buckets = [[] for i in range(len(order)+1)]
+	for e in elements:
+		buckets[rank.get(getattr(e, attribute), len(order))].append(e)
+	return [e for bucket in buckets for e in bucket]
+
+def shader_type_of(mat_base):
+	# The .w2mg or .w2mi file, minus the extension.
+	shader_type = mat_base.split("\\")[-1][:-5]
+	if(mat_base.endswith(".w2mi")):
+		# Material instances don't say which shader they use, so we guess.
+		if('hair' in shader_type):
+			return 'pbr_hair'
+		elif('skin' in shader_type):
+			return 'pbr_skin'
+		elif('eye' in shader_type):
+			return 'pbr_eye'
+		return 'pbr_std'
+	return shader_type
+
+def compile_recipe(mat_base, params, resolve_texture):
+	# Returns the MaterialRecipe of a material.
+	# params is a list of W3Params. resolve_texture(value) returns the absolute path of the texture of an .xbm value, or None.
+	shader_type = shader_type_of(mat_base)
+	group = SHADER_GROUPS.get(shader_type, 'Witcher3_Main')
+
+	# Node specs are built as dicts, since the mapping nodes of textures are modified by later params.
+	nodes = []
+	links = []
+	param_nodes = []
+	by_name = {}	# Param node name : index, for params that modify earlier nodes.
+	mapping_of = {}	# Texture node index : mapping node index.
+
+	def add_node(kind, **kwargs):
+		nodes.append(dict(kind=kind, **kwargs))
+		return len(nodes)-1
+
+	node_ng = add_node('ShaderNodeGroup', location=(500, 200), width=350, group=group)
+	for i, target in enumerate(['CYCLES', 'EEVEE']):
+		node_output = add_node('ShaderNodeOutputMaterial', name=mat_base, label=shader_type, location=(900, 200 - 200*i), props=(('target', target),))
+		links.append(LinkSpec(node_ng, i, node_output, 0))
+
+	y_loc = 1000	# Y location of the next node to spawn.
+	for param in order_elements_by_attribute(params, PARAM_ORDER, 'name'):
+		par_name = param.name
+		par_type = param.type
+		par_value = param.value
+
+		if(par_value == 'NULL' or
+			par_name in IGNORED_PARAMS):
+			continue
+
+		node_label = par_name
+		y_loc_increment = -170
+		node = None
+
+		### Texture inputs  ###
+		if(par_type=='handle:ITexture'):
+			tex_path = resolve_texture(par_value)
+			if(tex_path == None):
+				node_label = "MISSING:" + par_value
+			texture = TextureSpec(par_value, tex_path, par_name not in COLOR_TEXTURES, 'Normal' in par_name)
+			node = add_node('ShaderNodeTexImage', width=300, texture=texture)
+
+			### Some texture types need special treatment ###
+			if(par_name == 'Normal'):
+				links.append(LinkSpec(node, 1, node_ng, 'Roughness'))
+			elif(par_name == 'Diffuse'):
+				links.append(LinkSpec(node, 1, node_ng, 'Alpha'))
+			elif( (('Normal' in par_name) and ('Detail' in par_name)) or
+			'SpecularShiftTexture' == par_name):
+				# DetailNormals need a Mapping node to apply the DetailScale and DetailRotation to.
+				node_mapping = add_node('ShaderNodeMapping', location=(-600, y_loc-200), hide=True, rotation=[0, 0, 0], scale=[1, 1, 1])
+				links.append(LinkSpec(node_mapping, 0, node, 0))
+				node_uv = add_node('ShaderNodeUVMap', location=(-800, y_loc-200), hide=True)
+				links.append(LinkSpec(node_uv, 0, node_mapping, 0))
+				mapping_of[node] = node_mapping
+
+			y_loc_increment = -320
+
+		### Float inputs ###
+		elif(par_type=='Float'):
+			if('Rotation' in par_name):
+				node_mapping = mapping_of.get(by_name.get(par_name.replace('Rotation', 'Normal')))
+				if(node_mapping != None):
+					nodes[node_mapping]['rotation'][2] = float(par_value)
+					continue
+			node = add_node('ShaderNodeValue', outputs=((0, float(par_value)),))
+
+		### Color inputs ###
+		elif(par_type=='Color'):
+			values = [float(f) for f in par_value.split("; ")]
+			if(values[3] == 255):	# If the Alpha value is 1, use the better looking CombineRGB node. (Discarding the useless alpha)
+				node = add_node('ShaderNodeCombineRGB', inputs=tuple((i, values[i]/255) for i in range(3)))
+			else:					# Otherwise, use the uglier RGB node which supports Alpha.
+				node = add_node('ShaderNodeRGB', outputs=((0, tuple(v/255 for v in values[:4])),))
+
+		### Vector inputs ###
+		elif(par_type=='Vector'):
+			values = [float(f) for f in par_value.split("; ")]
+			# Handling UV scale nodes for detail normals and SpecularShiftTextures
+			if( ('Tile' in par_name) or ('SpecularShiftUVScale' in par_name) ):
+				target_node = by_name.get(par_name.replace('Tile', 'Normal'))
+				if(target_node == None):
+					target_node = by_name.get('SpecularShiftTexture')
+				node_mapping = mapping_of.get(target_node)
+				if(node_mapping != None):
+					nodes[node_mapping]['scale'][0] = values[0]
+					nodes[node_mapping]['scale'][1] = values[1]
+					continue
+			if(values[3] != 1 and values[3] != 0):	# The 4th value on vectors is probably always useless, but just in case.
+				print("Warning: Discarded vector 4th value: " + str(values) + " in parameter: " + par_name)
+			node = add_node('ShaderNodeCombineXYZ', inputs=tuple((i, values[i]) for i in range(3)))
+
+		# Unknown inputs are created as an Attribute node.
+		else:
+			print("Unknown material parameter type: "+par_type)
+			node_label = "Unknown type: " + par_type
+			node = add_node('ShaderNodeAttribute', props=(('attribute_name', par_value),))
+
+		nodes[node]['location'] = (-450, y_loc)
+		nodes[node]['name'] = par_name
+		nodes[node]['label'] = node_label
+		by_name.setdefault(par_name, node)
+		param_nodes.append(node)
+		y_loc = y_loc + y_loc_increment
+
+		# Linking the node to the node group
+		if( node_label in EQUIVALENT_PARAMS ):
+			links.append(LinkSpec(node, 0, node_ng, EQUIVALENT_PARAMS[node_label], only_if_free=True))
+		links.append(LinkSpec(node, 0, node_ng, node_label))
+
+	return MaterialRecipe(mat_base, shader_type, group, tuple(freeze_node(n) for n in nodes), tuple(links), tuple(param_nodes))
+
+def freeze_node(node):
+	# Turns a node dict from compile_recipe() into a NodeSpec.
+	node = dict(node)
+	props = list(node.pop('props', ()))
+	for attr in ['rotation', 'scale']:
+		if(attr in node):
+			props.append( (attr, tuple(node.pop(attr))) )
+	node['props'] = tuple(props)
+	return NodeSpec(**node)
+
+def recipe_signature(recipe):
+	# Hash of the node structure of a recipe: node types, names, placement and links, without the values and textures.
+	# Materials with the same signature only differ in what set_recipe_values() sets, so one can be made by copying the other.
+	# The output nodes are named after the base material, so those names are left out too.
+	nodes = []
+	for spec in recipe.nodes:
+		nodes.append( (spec.kind, spec.name if spec.name != recipe.base else None, spec.location, spec.width, spec.hide, spec.group,
+			tuple(attr for attr, value in spec.props), tuple(i for i, value in spec.inputs), tuple(i for i, value in spec.outputs), spec.texture != None) )
+	key = repr( (recipe.group, tuple(nodes), recipe.links, recipe.param_nodes) )
+	return hashlib.sha1(key.encode('utf-8')).hexdigest()
@@ -0,0 +1,77 @@
+# Blender Witcher 3 Importer Add-on
+# Copyright (C) 2019 Mets3D
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Streaming reader for the material info in the .xml files exported by wcc_lite.exe.
+# Only the <materials> element is kept, as small W3Material/W3Param records. The rest of the file is parsed and thrown away element by element,
+# so the whole tree is never in memory at once.
+# This file must not import bpy, it's used by background threads.
+
+import xml.etree.ElementTree as ET
+
+CHUNK_SIZE = 64 * 1024
+
+class W3Param:
+	__slots__ = ('name', 'type', 'value')
+
+	def __init__(self, name, type, value):
+		self.name = name
+		self.type = type
+		self.value = value
+
+	def __repr__(self):
+		return "W3Param(%r, %r, %r)" %(self.name, self.type, self.value)
+
+class W3Material:
+	__slots__ = ('name', 'base', 'params')
+
+	def __init__(self, name, base, params=None):
+		self.name = name
+		self.base = base		# Path to the .w2mg or .w2mi file.
+		self.params = params if params != None else []
+
+	def __repr__(self):
+		return "W3Material(%r, %r, %d params)" %(self.name, self.base, len(self.params))
+
+def iter_materials(xml_path, chunk_size=CHUNK_SIZE):
+	# Yields a W3Material for every <material> in the <materials> element under the root, in file order.
+	# The files declare UTF-16 but aren't, which makes the parser reject them when it reads bytes. Feeding it decoded text makes it ignore the declaration.
+	parser = ET.XMLPullParser(events=('start', 'end'))
+	stack = []			# Elements that are open at the current point of the file.
+	material = None		# Material being read.
+	with open(xml_path, 'r') as f:
+		for chunk in iter(lambda: f.read(chunk_size), ''):
+			parser.feed(chunk)
+			for event, element in parser.read_events():
+				if(event == 'start'):
+					stack.append(element)
+					depth = len(stack)
+					if(depth == 3 and element.tag == 'material' and stack[1].tag == 'materials'):
+						material = W3Material(element.get('name'), element.get('base'))
+					elif(depth == 4 and material != None and element.tag == 'param'):
+						material.params.append(W3Param(element.get('name'), element.get('type'), element.get('value')))
+					continue
+
+				stack.pop()
+				if(material != None and len(stack) == 2 and element.tag == 'material'):
+					yield material
+					material = None
+				# Everything before this point of the file has been read, so the finished children can be dropped.
+				if(len(stack) > 0):
+					del stack[-1][:]
+		parser.close()
+
+def read_materials(xml_path):
+	return list(iter_materials(xml_path))
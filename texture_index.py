@@ -0,0 +1,122 @@
+# Blender Witcher 3 Importer Add-on
+# Copyright (C) 2019 Mets3D
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Index of the texture files in the Uncooked folder, so texture lookups don't have to hit the disk (which is often a NAS).
+# Doesn't use bpy, so it can also be used outside of Blender.
+
+import os
+import json
+
+TEXTURE_EXTENSIONS = ('.tga',)
+INDEX_VERSION = 1
+
+def normalize_rel_path(rel_path):
+	# Witcher 3 paths use backslashes and aren't consistent about case.
+	return rel_path.replace("\\", "/").strip("/").lower()
+
+class TextureIndex:
+	def __init__(self, root, index_path=None):
+		self.root = os.path.abspath(root)
+		self.index_path = index_path	# Where the index is stored on disk. If None, the index only lives in memory.
+		self.dirs = {}		# Relative directory path : [mtime, [subdirectory names], [texture file names]]
+		self.files = {}		# Lowercase relative file path : absolute file path
+
+	def load(self):
+		# Load the index from disk. Returns False if there was no usable index.
+		if(self.index_path == None or not os.path.isfile(self.index_path)):
+			return False
+		try:
+			with open(self.index_path, 'r') as f:
+				data = json.load(f)
+		except (OSError, ValueError):
+			return False
+		if(data.get('version') != INDEX_VERSION or data.get('root') != self.root):
+			return False
+		self.dirs = data['dirs']
+		self.build_file_table()
+		return True
+
+	def save(self):
+		if(self.index_path == None): return
+		data = {'version' : INDEX_VERSION, 'root' : self.root, 'dirs' : self.dirs}
+		tmp_path = self.index_path + ".tmp"
+		with open(tmp_path, 'w') as f:
+			json.dump(data, f, separators=(',', ':'))
+		os.replace(tmp_path, self.index_path)
+
+	def refresh(self):
+		# Bring the index up to date with the disk. Directories whose mtime didn't change are not listed again,
+		# so after the first scan this costs one stat() per directory instead of one per texture.
+		# Returns whether anything changed.
+		old_dirs = self.dirs
+		new_dirs = {}
+		changed = False
+
+		stack = ['']
+		while(len(stack) > 0):
+			rel_dir = stack.pop()
+			abs_dir = os.path.join(self.root, *rel_dir.split("/")) if rel_dir else self.root
+			try:
+				mtime = os.stat(abs_dir).st_mtime
+			except OSError:
+				# Directory was deleted.
+				changed = True
+				continue
+
+			entry = old_dirs.get(rel_dir)
+			if(entry == None or entry[0] != mtime):
+				changed = True
+				subdirs = []
+				files = []
+				try:
+					with os.scandir(abs_dir) as it:
+						for de in it:
+							if(de.is_dir()):
+								subdirs.append(de.name)
+							elif(de.name.lower().endswith(TEXTURE_EXTENSIONS)):
+								files.append(de.name)
+				except OSError:
+					continue
+				entry = [mtime, subdirs, files]
+			new_dirs[rel_dir] = entry
+
+			for subdir in entry[1]:
+				stack.append(rel_dir + "/" + subdir if rel_dir else subdir)
+
+		if(len(new_dirs) != len(old_dirs)):
+			changed = True
+		self.dirs = new_dirs
+		if(changed or len(self.files) == 0):
+			self.build_file_table()
+		return changed
+
+	def build_file_table(self):
+		self.files = {}
+		for rel_dir, entry in self.dirs.items():
+			abs_dir = os.path.join(self.root, *rel_dir.split("/")) if rel_dir else self.root
+			for name in entry[2]:
+				rel_path = rel_dir + "/" + name if rel_dir else name
+				self.files[rel_path.lower()] = os.path.join(abs_dir, name)
+
+	def resolve(self, rel_path):
+		# Returns the absolute path of a texture given its path relative to the Uncooked folder, or None if it doesn't exist.
+		return self.files.get(normalize_rel_path(rel_path))
+
+	def missing(self, rel_paths):
+		return [p for p in rel_paths if self.resolve(p) == None]
+
+	def __len__(self):
+		return len(self.files)
@@ -0,0 +1,151 @@
+# Blender Witcher 3 Importer Add-on
+# Copyright (C) 2019 Mets3D
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Downscaled preview copies of .tga textures, for faster viewport work. Previews are stored in a cache folder, keyed by the source path and mtime.
+# The decoding is done by separate Python processes, each running this file as a script on a chunk of the textures.
+# This file must not import bpy or anything from the add-on, since it's also run outside of Blender.
+
+import os
+import sys
+import json
+import struct
+import hashlib
+import subprocess
+
+import numpy as np
+
+class TGAError(Exception):
+	pass
+
+def read_tga(path):
+	# Returns (pixels, descriptor), where pixels is a (height, width, channels) uint8 array in the file's channel order (BGR/BGRA/grey)
+	# and descriptor is the image descriptor byte, which holds the origin corner.
+	with open(path, 'rb') as f:
+		data = f.read()
+	if(len(data) < 18):
+		raise TGAError("Not a TGA file: " + path)
+	id_length, colormap_type, image_type = struct.unpack_from('<BBB', data, 0)
+	width, height, bpp, descriptor = struct.unpack_from('<HHBB', data, 12)
+	if(colormap_type != 0 or image_type not in (2, 3, 10, 11) or bpp not in (8, 24, 32)):
+		raise TGAError("Unsupported TGA format (type %d, %d bpp): %s" %(image_type, bpp, path))
+
+	channels = bpp // 8
+	offset = 18 + id_length
+	size = width * height * channels
+	if(image_type in (2, 3)):
+		if(len(data) < offset + size):
+			raise TGAError("Truncated pixel data: " + path)
+		pixels = np.frombuffer(data, dtype=np.uint8, count=size, offset=offset)
+	else:
+		pixels = np.frombuffer(decode_rle(data, offset, width * height, channels), dtype=np.uint8)
+	return pixels.reshape((height, width, channels)), descriptor
+
+def decode_rle(data, offset, pixel_count, channels):
+	out = bytearray()
+	decoded = 0
+	while(decoded < pixel_count):
+		if(offset >= len(data)):
+			raise TGAError("Truncated RLE data")
+		header = data[offset]
+		offset += 1
+		count = (header & 0x7f) + 1
+		size = channels if header & 0x80 else channels*count
+		if(offset + size > len(data)):
+			raise TGAError("Truncated RLE data")
+		if(header & 0x80):
+			# Run of one repeated pixel
+			out += data[offset:offset+size] * count
+		else:
+			# Raw pixels
+			out += data[offset:offset+size]
+		offset += size
+		decoded += count
+	return bytes(out[:pixel_count*channels])
+
+def write_tga(path, pixels, descriptor):
+	height, width, channels = pixels.shape
+	image_type = 3 if channels == 1 else 2
+	header = struct.pack('<BBBHHBHHHHBB', 0, 0, image_type, 0, 0, 0, 0, 0, width, height, channels*8, descriptor)
+	tmp_path = path + ".tmp"
+	with open(tmp_path, 'wb') as f:
+		f.write(header)
+		f.write(np.ascontiguousarray(pixels).tobytes())
+	os.replace(tmp_path, path)
+
+def downscale(pixels, factor):
+	# Box filter. Edge pixels that don't fill a whole box are cropped.
+	height, width, channels = pixels.shape
+	h = max(height // factor, 1)
+	w = max(width // factor, 1)
+	fy = min(factor, height)
+	fx = min(factor, width)
+	boxes = pixels[:h*fy, :w*fx].reshape((h, fy, w, fx, channels)).astype(np.uint32)
+	return (boxes.sum(axis=(1, 3)) // (fy*fx)).astype(np.uint8)
+
+def preview_path(src_path, factor, cache_dir):
+	# The preview keeps the file name of the source, so images and materials named after it come out the same.
+	st = os.stat(src_path)
+	key = "%s|%d|%d" %(os.path.normcase(os.path.abspath(src_path)), st.st_mtime_ns, st.st_size)
+	key_hash = hashlib.sha1(key.encode('utf-8')).hexdigest()[:20]
+	return os.path.join(cache_dir, "%s_%d" %(key_hash, factor), os.path.basename(src_path))
+
+def make_preview(src_path, dst_path, factor):
+	pixels, descriptor = read_tga(src_path)
+	os.makedirs(os.path.dirname(dst_path), exist_ok=True)
+	write_tga(dst_path, downscale(pixels, factor), descriptor)
+
+def make_previews(jobs):
+	# jobs is a list of (source path, preview path, factor). Returns the source paths that succeeded.
+	done = []
+	for src_path, dst_path, factor in jobs:
+		try:
+			make_preview(src_path, dst_path, factor)
+			done.append(src_path)
+		except (OSError, TGAError, ValueError) as e:
+			print("Could not make preview of %s: %s" %(src_path, e), file=sys.stderr)
+	return done
+
+def run_worker(python_exe, jobs):
+	# Runs make_previews() on a chunk of jobs in a separate Python process.
+	result = subprocess.run([python_exe, os.path.abspath(__file__)], input=json.dumps(jobs), stdout=subprocess.PIPE, universal_newlines=True)
+	if(result.returncode != 0):
+		return []
+	return json.loads(result.stdout)
+
+def plan_previews(src_paths, factor, cache_dir):
+	# Returns the {source path : preview path} of the previews that are already cached, and the jobs to make the missing ones.
+	previews = {}
+	jobs = []
+	for src_path in src_paths:
+		try:
+			dst_path = preview_path(src_path, factor, cache_dir)
+		except OSError:
+			continue
+		if(os.path.isfile(dst_path)):
+			previews[src_path] = dst_path
+		else:
+			jobs.append((src_path, dst_path, factor))
+	return previews, jobs
+
+def run_jobs(jobs, python_exe=None):
+	# Makes the previews of a list of jobs in a worker process of python_exe, or in this process without python_exe.
+	# Returns the {source path : preview path} of the ones that succeeded.
+	done = set(run_worker(python_exe, jobs) if python_exe != None else make_previews(jobs))
+	return {src_path : dst_path for src_path, dst_path, factor in jobs if src_path in done}
+
+if __name__ == '__main__':
+	# Worker process: jobs come in as JSON on stdin, the finished source paths go out as JSON on stdout.
+	print(json.dumps(make_previews(json.load(sys.stdin))))
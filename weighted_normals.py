@@ -13,14 +13,122 @@ bl_info = {
 }
 
 import bpy, bmesh, array
+import numpy as np
 from mathutils import Vector
 
+
+def calc_weighted_normals_numpy(mesh):
+    """Calculates area weighted normals of every smooth fan of the mesh and sets them as custom split normals.
+    Gives the same result as WeightNormalsCalculator.calc_weighted_normal, but reads and writes the mesh
+    data in bulk instead of walking BMesh adjacency, so it's suitable for high poly meshes.
+
+    Face corners (loops) of a vertex belong to the same smooth fan when their faces share a non-sharp edge
+    around that vertex. Corners that have only sharp edges around them keep their current normal.
+
+    :param mesh: mesh data, in object mode
+    :type mesh: bpy.types.Mesh
+    """
+    n_loops = len(mesh.loops)
+    n_polys = len(mesh.polygons)
+    n_edges = len(mesh.edges)
+    if n_loops == 0:
+        return
+
+    loop_verts = np.empty(n_loops, dtype=np.int64)
+    mesh.loops.foreach_get("vertex_index", loop_verts)
+    loop_edges = np.empty(n_loops, dtype=np.int64)
+    mesh.loops.foreach_get("edge_index", loop_edges)
+
+    loop_start = np.empty(n_polys, dtype=np.int64)
+    mesh.polygons.foreach_get("loop_start", loop_start)
+    loop_total = np.empty(n_polys, dtype=np.int64)
+    mesh.polygons.foreach_get("loop_total", loop_total)
+    poly_areas = np.empty(n_polys, dtype=np.float64)
+    mesh.polygons.foreach_get("area", poly_areas)
+    poly_normals = np.empty(n_polys * 3, dtype=np.float64)
+    mesh.polygons.foreach_get("normal", poly_normals)
+    poly_normals.shape = (n_polys, 3)
+
+    edge_sharp = np.empty(n_edges, dtype=bool)
+    mesh.edges.foreach_get("use_edge_sharp", edge_sharp)
+
+    mesh.calc_normals_split()
+    loop_normals = np.empty(n_loops * 3, dtype=np.float64)
+    mesh.loops.foreach_get("normal", loop_normals)
+    loop_normals.shape = (n_loops, 3)
+
+    loop_polys = np.repeat(np.arange(n_polys, dtype=np.int64), loop_total)
+
+    # A loop's edge goes from its vertex to the next loop's vertex, so the other edge around
+    # the same corner is the edge of the previous loop in the polygon.
+    loop_prev = np.arange(n_loops, dtype=np.int64) - 1
+    loop_prev[loop_start] = loop_start + loop_total - 1
+    prev_edges = loop_edges[loop_prev]
+
+    # Every corner touches two (vertex, edge) pairs. Corners sharing a pair across a smooth edge are in the same fan.
+    corners = np.concatenate((np.arange(n_loops, dtype=np.int64),) * 2)
+    pair_edges = np.concatenate((loop_edges, prev_edges))
+    pair_verts = np.concatenate((loop_verts, loop_verts))
+    smooth = ~edge_sharp[pair_edges]
+    corners = corners[smooth]
+    keys = pair_verts[smooth] * max(n_edges, 1) + pair_edges[smooth]
+
+    order = np.argsort(keys, kind="stable")
+    keys = keys[order]
+    corners = corners[order]
+    same = keys[1:] == keys[:-1]
+    link_a = corners[:-1][same]
+    link_b = corners[1:][same]
+
+    # Connected components of the corner links by label propagation, every corner ends up labelled with
+    # the lowest corner index of its fan. Fans are small, so this converges in a few iterations.
+    labels = np.arange(n_loops, dtype=np.int64)
+    while True:
+        lowest = np.minimum(labels[link_a], labels[link_b])
+        new_labels = labels.copy()
+        np.minimum.at(new_labels, link_a, lowest)
+        np.minimum.at(new_labels, link_b, lowest)
+        new_labels = new_labels[new_labels]
+        if np.array_equal(new_labels, labels):
+            break
+        labels = new_labels
+
+    # Sum the area weighted face normals of every fan by scatter-adding them onto the fan labels.
+    weighted = poly_normals[loop_polys] * poly_areas[loop_polys][:, np.newaxis]
+    fan_normals = np.empty((n_loops, 3), dtype=np.float64)
+    for axis in range(3):
+        fan_normals[:, axis] = np.bincount(labels, weights=weighted[:, axis], minlength=n_loops)
+    normals = fan_normals[labels]
+
+    lengths = np.linalg.norm(normals, axis=1)
+    valid = lengths > 0.0
+    normals[valid] /= lengths[valid][:, np.newaxis]
+
+    # Corners with no smooth edge around them, and fans with no area keep their current normal.
+    has_smooth = ~(edge_sharp[loop_edges] & edge_sharp[prev_edges])
+    keep = ~(has_smooth & valid)
+    normals[keep] = loop_normals[keep]
+
+    mesh.use_auto_smooth = True
+    mesh.normals_split_custom_set(normals)
+    mesh.free_normals_split()
+
 class WeightNormalsCalculator(bpy.types.Operator):
     """Calculate weighted normals for active object."""
     bl_idname = "object.calculate_weighted_normals"
     bl_label = "Weight Normals"
     bl_options = set()
 
+    engine: bpy.props.EnumProperty(
+        name="Engine",
+        description="Implementation used to calculate the normals",
+        items=(
+            ("NUMPY", "NumPy", "Calculate the normals of the whole mesh at once with NumPy arrays"),
+            ("BMESH", "BMesh (Reference)", "Calculate the normals face by face with BMesh. Slow, kept to compare results with"),
+        ),
+        default="NUMPY"
+    )
+
     cache = {}
     """Cache for calculated weighted normals. It stores normals by key: 'vert_index:edge_index'."""
 
@@ -105,6 +213,10 @@ class WeightNormalsCalculator(bpy.types.Operator):
 
     def execute(self, context):
 
+        if self.engine == "NUMPY":
+            calc_weighted_normals_numpy(context.object.data)
+            return {'FINISHED'}
+
         WeightNormalsCalculator.cache = {}
 
         mesh = context.object.data